@@ -0,0 +1,75 @@
+"""
+Batch post generation against the local chat-completions stand-in: throughput at several
+concurrency levels with injected 429 and 500 responses. Fails if any post is lost.
+
+    python -m benchmarks.batch_generation --posts 40 --latency 0.2
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from benchmarks.fake_servers import FakeOpenAI
+from core.artwork_analysis import Artwork, AsyncArtworkAnalyser
+from core.post_queue import PostQueue, generate_posts
+from main import prepare_post, with_review
+
+
+def fake_corpus(size):
+    return {
+        str(i): {
+            "name": f"Artwork {i}",
+            "authors": f"Author {i}",
+            "year": str(1987 + i % 30),
+            "award": "Honorary Mention",
+            "category": "Interactive Art",
+            "description": f"Description of artwork {i}",
+            "description_ru": f"Описание работы {i}",
+            "url": f"https://archive.aec.at/prix/showmode/{i}/",
+            "img_list": [f"https://archive.aec.at/media/{i}.jpg"],
+        }
+        for i in range(size)
+    }
+
+
+class FakeRetriever:
+    def __init__(self, data):
+        self.data = data
+
+    def get_related_artworks(self, main_artwork, k=2):
+        keys = [key for key in self.data if key != main_artwork.key][:k]
+        return [Artwork(self.data[key], key) for key in keys]
+
+
+async def run(base_url, data, concurrency, queue):
+    analyser = AsyncArtworkAnalyser("test", concurrency=concurrency, base_url=base_url)
+    start = time.perf_counter()
+    posts = await generate_posts(list(data), data, FakeRetriever(data), analyser, prepare_post, queue, with_review)
+    return posts, analyser.retries, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    args = parser.parse_args()
+
+    data = fake_corpus(args.posts)
+    with FakeOpenAI(latency=args.latency, rate_limit_every=7, server_error_every=11) as server:
+        for concurrency in args.concurrency:
+            with tempfile.TemporaryDirectory() as tmp:
+                queue = PostQueue(os.path.join(tmp, "queue.jsonl"))
+                posts, retries, elapsed = asyncio.run(run(server.base_url, data, concurrency, queue))
+                queued = len(queue.read())
+            print(
+                f"concurrency {concurrency:>3}: {len(posts)} posts in {elapsed:.2f}s "
+                f"({len(posts) / elapsed:.1f} posts/s), {retries} retries, {queued} queued"
+            )
+            if len(posts) != args.posts or queued != args.posts:
+                raise SystemExit("some posts were not generated")
+
+
+if __name__ == "__main__":
+    main()
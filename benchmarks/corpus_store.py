@@ -0,0 +1,69 @@
+"""
+Whole-file JSON load vs CorpusStore: time and peak Python memory (tracemalloc) to open the corpus
+and look up one record, and to stream all records.
+
+    python -m benchmarks.corpus_store --source ars_electronica_prizewinners_ru.json
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from core.corpus import CorpusStore
+
+
+def measure(function):
+    tracemalloc.start()
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed * 1000, peak / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", default="ars_electronica_prizewinners_ru.json")
+    args = parser.parse_args()
+
+    with open(args.source, "r", encoding="utf-8") as f:
+        key = random.Random(0).choice(list(json.load(f)))
+
+    def json_lookup():
+        with open(args.source, "r", encoding="utf-8") as f:
+            return json.load(f)[key]
+
+    def json_stream():
+        with open(args.source, "r", encoding="utf-8") as f:
+            for _ in json.load(f).items():
+                pass
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "corpus.sqlite")
+        start = time.perf_counter()
+        CorpusStore.import_json(args.source, path)
+        print(f"import: {time.perf_counter() - start:.2f}s, {os.path.getsize(path) / 2 ** 20:.1f} MiB on disk")
+
+        def store_lookup():
+            return CorpusStore(path)[key]
+
+        def store_stream():
+            for _ in CorpusStore(path).items():
+                pass
+
+        for name, function in [
+            ("json lookup", json_lookup),
+            ("store lookup", store_lookup),
+            ("json stream", json_stream),
+            ("store stream", store_stream),
+        ]:
+            elapsed, peak = measure(function)
+            print(f"{name:>12}: {elapsed:8.2f} ms, peak {peak:7.2f} MiB")
+
+
+if __name__ == "__main__":
+    main()
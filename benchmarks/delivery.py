@@ -0,0 +1,96 @@
+"""
+Delivery latency against the local fake Bot API: a Bot created per post (as the cron runs did) vs one shared
+Delivery, and a post sent to several channels one after another vs Delivery.fan_out. With --flood-every,
+every N-th send gets a flood wait; the script fails if a step was lost or delivered twice.
+
+    python -m benchmarks.delivery --posts 20 --channels 4 --latency 0.1 --flood-every 15
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+
+from benchmarks.fake_servers import FakeTelegram
+from core.delivery import Delivery
+
+TOKEN = "123456:fake"
+
+
+def fake_post(number):
+    return {
+        "key": f"post-{number}",
+        "message": f"*Artwork {number}*\n\n" + "description " * 120,
+        "caption": f"*Artwork {number}*",
+        "images": [f"https://example.com/{number}/{i}.jpg" for i in range(3)],
+        "review": f"Review {number}\n\n_Рецензия GPT-4_",
+    }
+
+
+async def per_post_bot(fake, posts, chat_ids):
+    latencies = []
+    for post in posts:
+        start = time.perf_counter()
+        async with Delivery(TOKEN, base_url=fake.base_url) as delivery:
+            for chat_id in chat_ids:
+                await delivery.deliver(post, chat_id)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def shared_sequential(fake, posts, chat_ids):
+    latencies = []
+    async with Delivery(TOKEN, base_url=fake.base_url) as delivery:
+        for post in posts:
+            start = time.perf_counter()
+            for chat_id in chat_ids:
+                await delivery.deliver(post, chat_id)
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def shared_fan_out(fake, posts, chat_ids):
+    latencies = []
+    async with Delivery(TOKEN, base_url=fake.base_url) as delivery:
+        for post in posts:
+            start = time.perf_counter()
+            results = await delivery.fan_out(post, chat_ids)
+            failed = [result for result in results.values() if isinstance(result, Exception)]
+            if failed:
+                raise failed[0]
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=20)
+    parser.add_argument("--channels", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds per fake Bot API request")
+    parser.add_argument("--flood-every", type=int, default=0)
+    args = parser.parse_args()
+
+    posts = [fake_post(i) for i in range(args.posts)]
+    chat_ids = [f"@channel_{i}" for i in range(args.channels)]
+    mismatches = 0
+    for name, run in [
+        ("bot per post", per_post_bot),
+        ("shared, sequential", shared_sequential),
+        ("shared, fan-out", shared_fan_out),
+    ]:
+        with FakeTelegram(latency=args.latency, flood_every=args.flood_every) as fake:
+            latencies = asyncio.run(run(fake, posts, chat_ids))
+            delivered = len(fake.messages)
+        # the message and the review, and a media group message per photo, to every channel
+        expected = len(posts) * len(chat_ids) * (2 + len(posts[0]["images"]))
+        mismatches += delivered != expected
+        latencies.sort()
+        print(f"{name:>20}: p50 {statistics.median(latencies) * 1000:7.1f} ms, "
+              f"max {latencies[-1] * 1000:7.1f} ms, {delivered}/{expected} messages")
+    if mismatches:
+        print("Messages were lost or delivered more than once")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
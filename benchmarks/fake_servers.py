@@ -0,0 +1,216 @@
+"""
+Local stand-ins for the external HTTP APIs, for benchmarks and checks that must not reach the network.
+"""
+import itertools
+import json
+import re
+import threading
+import time
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class FakeServer:
+    """
+    Runs a handler class on a free localhost port in a background thread
+    """
+
+    def __init__(self, handler):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.server.fake = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeOpenAI(FakeServer):
+    """
+    Mimics POST /v1/chat/completions. Every rate_limit_every-th request is answered with 429 and
+    retry-after-ms, every server_error_every-th one with 500; the others after `latency` seconds
+    """
+
+    def __init__(self, latency=0.05, rate_limit_every=0, server_error_every=0, retry_after_ms=50):
+        super().__init__(ChatCompletionsHandler)
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.server_error_every = server_error_every
+        self.retry_after_ms = retry_after_ms
+        self.counter = itertools.count(1)
+        self.requests = []
+
+    @property
+    def base_url(self):
+        return self.url + "/v1"
+
+
+class FakeTelegram(FakeServer):
+    """
+    Mimics the Bot API methods used for posting (getMe, sendMessage, sendPhoto, sendMediaGroup) at
+    {url}/bot<token>/<method>. Every flood_every-th send is answered with 429 and retry_after,
+    every server_error_every-th one with 502; markdown with unbalanced * or _ gets 400 like on Telegram,
+    and so does every send to one of failing_chats (a channel the bot can not post to).
+    Delivered messages are kept in `messages` as (chat_id, method, text) to check for duplicates
+    """
+
+    def __init__(self, latency=0.05, flood_every=0, server_error_every=0, retry_after=1, failing_chats=()):
+        super().__init__(BotAPIHandler)
+        self.latency = latency
+        self.flood_every = flood_every
+        self.server_error_every = server_error_every
+        self.retry_after = retry_after
+        self.failing_chats = set(failing_chats)
+        self.counter = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.messages = []
+
+    @property
+    def base_url(self):
+        return self.url + "/bot"
+
+
+class JSONHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class ChatCompletionsHandler(JSONHandler):
+    def do_POST(self):
+        fake = self.server.fake
+        request = self.read_json()
+        number = next(fake.counter)
+        fake.requests.append(request)
+
+        if not self.path.endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": "not found"}})
+            return
+        if fake.rate_limit_every and number % fake.rate_limit_every == 0:
+            self.send_json(
+                429,
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                {"retry-after-ms": str(fake.retry_after_ms)},
+            )
+            return
+        if fake.server_error_every and number % fake.server_error_every == 0:
+            self.send_json(500, {"error": {"message": "The server had an error", "type": "server_error"}})
+            return
+
+        time.sleep(fake.latency)
+        prompt = request["messages"][0]["content"][0]["text"]
+        self.send_json(
+            200,
+            {
+                "id": f"chatcmpl-{number}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "gpt-4o"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": f"Review #{number}"},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": len(prompt.split()),
+                    "completion_tokens": 2,
+                    "total_tokens": len(prompt.split()) + 2,
+                },
+            },
+            {"x-ratelimit-remaining-requests": "1000", "x-ratelimit-reset-requests": "1s"},
+        )
+
+
+class BotAPIHandler(JSONHandler):
+    def read_params(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.startswith("multipart/form-data"):
+            message = BytesParser(policy=policy.default).parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode() + body
+            )
+            return {
+                part.get_param("name", header="content-disposition"): part.get_content()
+                for part in message.iter_parts()
+            }
+        if content_type.startswith("application/json"):
+            return json.loads(body or b"{}")
+        return {name: values[0] for name, values in parse_qs(body.decode()).items()}
+
+    @staticmethod
+    def unbalanced_markdown(text):
+        text = re.sub(r"\\[_*]", "", text or "")
+        return text.count("*") % 2 == 1 or text.count("_") % 2 == 1
+
+    def do_POST(self):
+        fake = self.server.fake
+        method = self.path.rsplit("/", 1)[-1]
+        params = self.read_params()
+        if method == "getMe":
+            self.send_json(200, {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Fake",
+                                                        "username": "fake_bot"}})
+            return
+        if method not in ("sendMessage", "sendPhoto", "sendMediaGroup"):
+            self.send_json(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+            return
+
+        number = next(fake.counter)
+        if params.get("chat_id") in fake.failing_chats:
+            self.send_json(400, {"ok": False, "error_code": 400, "description": "Bad Request: chat not found"})
+            return
+        if fake.flood_every and number % fake.flood_every == 0:
+            self.send_json(429, {
+                "ok": False, "error_code": 429, "description": f"Too Many Requests: retry after {fake.retry_after}",
+                "parameters": {"retry_after": fake.retry_after},
+            })
+            return
+        if fake.server_error_every and number % fake.server_error_every == 0:
+            self.send_json(502, {"ok": False, "error_code": 502, "description": "Bad Gateway"})
+            return
+
+        media = json.loads(params.get("media", "[]")) if method == "sendMediaGroup" else [None]
+        text = params.get("text") or params.get("caption") or (media[0] or {}).get("caption")
+        parse_mode = params.get("parse_mode") or (media[0] or {}).get("parse_mode")
+        if parse_mode and self.unbalanced_markdown(text):
+            self.send_json(400, {"ok": False, "error_code": 400,
+                                 "description": "Bad Request: can't parse entities"})
+            return
+
+        time.sleep(fake.latency)
+        chat_id = params.get("chat_id")
+        results = []
+        with fake.lock:
+            for _ in media:
+                message_id = next(fake.message_ids)
+                fake.messages.append((chat_id, method, text))
+                results.append({"message_id": message_id, "date": int(time.time()),
+                                "chat": {"id": -100, "type": "channel", "username": str(chat_id).strip("@")}})
+        self.send_json(200, {"ok": True, "result": results if method == "sendMediaGroup" else results[0]})
@@ -0,0 +1,66 @@
+"""
+Metadata-filtered related artworks: post-filtering the unconstrained top records vs the bitmap filter of
+VectorDB.search_records, for every category and a year range. Reports how many queries got k results
+and the query latency of both.
+
+    python -m benchmarks.filtered_search --source ars_electronica_prizewinners_ru.json --index-type ivfpq
+"""
+import argparse
+import random
+import time
+from collections import Counter
+
+from benchmarks.record_retrieval import percentile
+from core.artwork_analysis import Artwork
+from core.corpus import open_corpus
+from core.document_retrieval import VectorDB
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", default="ars_electronica_prizewinners_ru.json")
+    parser.add_argument("--index-type", default="flat")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("-k", type=int, default=2)
+    parser.add_argument("--post-filter-k", type=int, default=4, help="unconstrained hits that are post-filtered")
+    args = parser.parse_args()
+
+    data = open_corpus(args.source)
+    vector_db = VectorDB(args.source, index_type=args.index_type)
+    vector_db.create_db()
+    keys = random.Random(0).sample(list(data), min(args.queries, len(data)))
+    vectors = vector_db.embeddings.embed_documents([Artwork(data[key], key).description for key in keys])
+    exclude = [{key} for key in keys]
+    metadata = vector_db.metadata_index()
+
+    categories = Counter(data[key].get("category") for key in data)
+    filters = [{"category": category} for category, _ in categories.most_common()]
+    filters.append({"year": (None, 1999)})
+    print(f"{'filter':>45} {'records':>7} | post-filter: full, p50 ms | bitmap: full, p50 ms")
+    for where in filters:
+        allowed = set(metadata.mask(where).nonzero()[0])
+        matching = len({vector_db.position_keys[position] for position in allowed})
+
+        start = time.perf_counter()
+        unconstrained = vector_db.search_records(vectors, args.post_filter_k, exclude)
+        post_filter_ms = (time.perf_counter() - start) * 1000 / len(keys)
+        post_filtered = [
+            [record for record in records if record[2] in allowed][:args.k] for records in unconstrained
+        ]
+
+        latencies = []
+        filtered = []
+        for vector, query_exclude in zip(vectors, exclude):
+            start = time.perf_counter()
+            filtered.extend(vector_db.search_records([vector], args.k, [query_exclude], where=where))
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        expected = min(args.k, matching)
+        post_full = sum(len(records) >= expected for records in post_filtered)
+        full = sum(len(records) >= expected for records in filtered)
+        print(f"{str(where)[:45]:>45} {matching:>7} | {post_full:>4}/{len(keys)}, {post_filter_ms:6.2f} | "
+              f"{full:>4}/{len(keys)}, {percentile(latencies, 0.5):6.2f} (p99 {percentile(latencies, 0.99):.2f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Formatting every record of the corpus with core.formatter vs the previous main.py functions (kept below as
+the baseline): time per post, posts over the length limits, and posts the fake Bot API would reject for
+unbalanced markdown (which the old code only handled by resending without markdown).
+
+    python -m benchmarks.formatter --source ars_electronica_prizewinners_ru.json --repeat 5
+"""
+import argparse
+import time
+
+from benchmarks.fake_servers import BotAPIHandler
+from core import formatter
+from core.corpus import open_corpus
+
+
+def legacy_message_text(artwork, message_length=0, to_cut=False):
+    if to_cut:
+        return f'*{artwork["name"]}*\n\n{artwork["authors"]}\n\n_{artwork["award"]}, {artwork["year"]}_\n' \
+               f'_{artwork["category"]}_\n\n{legacy_cut(artwork["description_ru"], message_length)}\n\n' \
+               f'{artwork["url"]}\n\n{legacy_hashtag(artwork["award"])} {legacy_hashtag(artwork["category"])} ' \
+               f'{legacy_hashtag(artwork["year"]) + "year"}'
+    return f'*{artwork["name"]}*\n\n{artwork["authors"]}\n\n_{artwork["award"]}, {artwork["year"]}_\n' \
+           f'_{artwork["category"]}_\n\n{artwork["description_ru"]}\n\n{artwork["url"]}\n\n' \
+           f'{legacy_hashtag(artwork["award"])} {legacy_hashtag(artwork["category"])} ' \
+           f'{legacy_hashtag(artwork["year"]) + "year"}'
+
+
+def legacy_caption_text(artwork):
+    return f'*{artwork["name"]}*\n\n_{artwork["authors"]} ({artwork["year"]})_\n\n{artwork["url"]}\n\n' \
+           f'{legacy_hashtag(artwork["award"])} {legacy_hashtag(artwork["category"])} ' \
+           f'{legacy_hashtag(artwork["year"]) + "year"}'
+
+
+def legacy_cut(text, length):
+    return text[:formatter.MAX_POST_LENGTH - length - 3] + '...'
+
+
+def legacy_hashtag(text):
+    return '#' + text.lower().replace('-', '').replace('–', '') \
+        .replace('(', '').replace(')', '').replace('/', ' ').replace('&', '') \
+        .replace('   ', ' ').replace('  ', ' ').replace(' ', '\\_')
+
+
+def legacy_format(artwork):
+    message = legacy_message_text(artwork)
+    if len(message) >= formatter.MAX_POST_LENGTH:
+        message = legacy_message_text(artwork, len(message) - len(artwork['description_ru']), to_cut=True)
+    return message, legacy_caption_text(artwork)
+
+
+def new_format(artwork):
+    return formatter.message_text(artwork), formatter.caption_text(artwork)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", default="ars_electronica_prizewinners_ru.json")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    artworks = list(open_corpus(args.source).values())
+    for name, format_post in [("legacy", legacy_format), ("formatter", new_format)]:
+        formatter.hashtag.cache_clear()
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            posts = [format_post(artwork) for artwork in artworks]
+        elapsed = (time.perf_counter() - start) / args.repeat
+        too_long = sum(
+            len(message) > formatter.MAX_POST_LENGTH or len(caption) > formatter.MAX_CAPTION_LENGTH
+            for message, caption in posts
+        )
+        rejected = sum(
+            BotAPIHandler.unbalanced_markdown(message) or BotAPIHandler.unbalanced_markdown(caption)
+            for message, caption in posts
+        )
+        print(f"{name:>10}: {elapsed * 1e6 / len(artworks):6.1f} µs/post, {elapsed:.3f} s per corpus, "
+              f"{too_long} over the limits, {rejected} with unbalanced markdown")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+BM25 alone, vector records and the hybrid (reciprocal rank fusion) mode of Retriever.get_top_k:
+query latency, and how often the related artworks share an author or the category with the query one,
+the obvious matches the embeddings alone tend to miss. Also reports the BM25 build time and size.
+
+    python -m benchmarks.hybrid_retrieval --source ars_electronica_prizewinners_ru.json
+"""
+import argparse
+import os
+import random
+import re
+import tempfile
+import time
+
+from benchmarks.record_retrieval import percentile
+from core.artwork_analysis import Artwork
+from core.corpus import open_corpus
+from core.document_retrieval import Retriever, VectorDB
+from core.lexical import BM25Index
+
+
+def authors(record):
+    return {name.strip().lower() for name in re.split(r"[,;&]| and ", record.get("authors") or "") if name.strip()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", default="ars_electronica_prizewinners_ru.json")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=2)
+    args = parser.parse_args()
+
+    data = open_corpus(args.source)
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        lexical = BM25Index.from_corpus(args.source, tmp)
+        build_time = time.perf_counter() - start
+        size = sum(os.path.getsize(os.path.join(tmp, name)) for name in os.listdir(tmp))
+    print(f"BM25: {len(lexical)} records, {len(lexical.terms)} terms, built in {build_time:.2f}s, "
+          f"{size / 2 ** 20:.1f} MiB on disk")
+
+    vector_db = VectorDB(args.source)
+    vector_db.create_db()
+    keys = random.Random(0).sample(list(data), min(args.queries, len(data)))
+    artworks = [Artwork(data[key], key) for key in keys]
+
+    def bm25_top_k(artwork):
+        return [key for key, _ in lexical.search_record(artwork.key, args.k)]
+
+    retrievers = {"records": Retriever(vector_db), "hybrid": Retriever(vector_db, "hybrid", lexical=lexical)}
+
+    def retriever_top_k(mode):
+        def top_k(artwork):
+            docs = retrievers[mode].get_top_k(artwork.description, artwork.key, args.k)
+            return [doc.metadata["key"] for doc in docs]
+        return top_k
+
+    results = {}
+    for mode, top_k in [("bm25", bm25_top_k), ("records", retriever_top_k("records")),
+                        ("hybrid", retriever_top_k("hybrid"))]:
+        latencies, same_author, same_category, found = [], 0, 0, []
+        for artwork in artworks:
+            start = time.perf_counter()
+            related = top_k(artwork)
+            latencies.append((time.perf_counter() - start) * 1000)
+            found.append(set(related))
+            record = data[artwork.key]
+            for key in related:
+                same_author += bool(authors(record) & authors(data[key]))
+                same_category += record.get("category") == data[key].get("category")
+        results[mode] = found
+        total = args.k * len(artworks)
+        print(
+            f"{mode:>8}: same author {same_author / total:.3f}, same category {same_category / total:.3f}, "
+            f"p50 {percentile(latencies, 0.5):.3f} ms, p99 {percentile(latencies, 0.99):.3f} ms"
+        )
+    kept = sum(len(hybrid & records) for hybrid, records in zip(results["hybrid"], results["records"]))
+    print(f"hybrid keeps {kept / (args.k * len(artworks)):.3f} of the vector picks")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Import-time report for the main.py entry point, based on python -X importtime.
+Fails if one of the heavy backends is imported or the total exceeds --budget-ms.
+
+    python -m benchmarks.import_time --budget-ms 1500
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+HEAVY_MODULES = (
+    "torch",
+    "transformers",
+    "sentence_transformers",
+    "faiss",
+    "langchain_community",
+    "PIL",
+)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(module):
+    """
+    Returns {module name: (self us, cumulative us, nesting depth)} for a fresh interpreter
+    importing module
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        times[name.strip()] = (int(self_us), int(cumulative_us), depth)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--budget-ms", type=float, default=None)
+    args = parser.parse_args()
+
+    times = import_times(args.module)
+    top_level = {name: cumulative for name, (_, cumulative, depth) in times.items() if depth == 0}
+    total_ms = sum(top_level.values()) / 1000
+
+    print(f"import {args.module}: {total_ms:.1f} ms, {len(times)} modules")
+    for name, cumulative in sorted(top_level.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{cumulative / 1000:10.1f} ms  {name}")
+
+    heavy = sorted(name for name in times if name.split(".")[0] in HEAVY_MODULES)
+    if heavy:
+        roots = sorted({name.split(".")[0] for name in heavy})
+        raise SystemExit(f"heavy backends imported: {', '.join(roots)}")
+    if args.budget_ms is not None and total_ms > args.budget_ms:
+        raise SystemExit(f"import time {total_ms:.1f} ms exceeds the budget of {args.budget_ms} ms")
+
+
+if __name__ == "__main__":
+    main()
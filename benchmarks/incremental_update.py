@@ -0,0 +1,64 @@
+"""
+Time of an incremental index update vs a full rebuild. That both answer queries the same way is checked
+by tests/test_incremental_update.py.
+
+The "old" corpus is the source without its last --appended records and with --changed records
+edited; the cached index built from it is then updated to the real source.
+
+    python -m benchmarks.incremental_update --source ars_electronica_prizewinners_ru.json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from core.document_retrieval import VectorDB
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", default="ars_electronica_prizewinners_ru.json")
+    parser.add_argument("--appended", type=int, default=50)
+    parser.add_argument("--changed", type=int, default=20)
+    args = parser.parse_args()
+
+    with open(args.source, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    keys = list(data)
+    rng = random.Random(0)
+
+    old_data = {key: dict(data[key]) for key in keys[:-args.appended]}
+    for key in rng.sample(list(old_data), args.changed):
+        old_data[key]["description_ru"] = old_data[key].get("description_ru", "")[::-1]
+    # a record that exists only in the old corpus must be deleted from the index
+    old_data["__deleted__"] = dict(data[keys[0]])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "corpus.json")
+        cache_dir = os.path.join(tmp, "cache")
+        with open(source, "w", encoding="utf-8") as f:
+            json.dump(old_data, f, ensure_ascii=False)
+        VectorDB(source, cache_dir=cache_dir).create_db()
+
+        shutil.copyfile(args.source, source)
+        incremental = VectorDB(source, cache_dir=cache_dir)
+        incremental.init_embeddings()
+        start = time.perf_counter()
+        incremental.create_db()
+        incremental_time = time.perf_counter() - start
+
+        full = VectorDB(source, cache_dir=None)
+        full.embeddings = incremental.embeddings
+        start = time.perf_counter()
+        full.create_db()
+        full_time = time.perf_counter() - start
+
+    print(f"vectors: incremental {incremental.db.index.ntotal}, full {full.db.index.ntotal}")
+    print(f"update {incremental_time:.2f}s, full rebuild {full_time:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Memory footprint, build time, query latency and recall@k of the VectorDB index types
+against the exact flat index with the same metric. The corpus is embedded once and
+every index is trained and filled from the same vectors.
+
+    python -m benchmarks.index_types --source ars_electronica_prizewinners_ru.json
+"""
+import argparse
+import random
+import time
+
+import faiss
+import numpy as np
+
+from core.document_retrieval import VectorDB
+
+CONFIGS = [
+    ("flat", "l2"),
+    ("sq8", "l2"),
+    ("ivfpq", "l2"),
+    ("flat", "cosine"),
+    ("sq8", "cosine"),
+    ("ivfpq", "cosine"),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", default="ars_electronica_prizewinners_ru.json")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--nprobe", type=int, default=8)
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    vector_db = VectorDB(args.source, cache_dir=None)
+    vector_db.init_embeddings()
+    vector_db.load()
+    start = time.perf_counter()
+    vectors = np.array(
+        vector_db.embeddings.embed_documents([doc.page_content for doc in vector_db.docs]),
+        dtype=np.float32,
+    )
+    print(f"embedded {len(vectors)} chunks in {time.perf_counter() - start:.2f}s")
+    rows = random.Random(0).sample(range(len(vectors)), min(args.queries, len(vectors)))
+    queries = vectors[rows]
+
+    exact = {}
+    for index_type, metric in CONFIGS:
+        config = VectorDB(args.source, cache_dir=None, index_type=index_type, metric=metric, nprobe=args.nprobe)
+        start = time.perf_counter()
+        index = config.new_index(vectors)
+        data = vectors.copy()
+        metric_queries = queries.copy()
+        if metric == "cosine":
+            faiss.normalize_L2(data)
+            faiss.normalize_L2(metric_queries)
+        index.add(data)
+        build_time = time.perf_counter() - start
+
+        size = len(faiss.serialize_index(index))
+        latencies = []
+        found = []
+        for query in metric_queries:
+            start = time.perf_counter()
+            _, positions = index.search(query[None, :], args.k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            found.append(set(positions[0]))
+        if index_type == "flat":
+            exact[metric] = found
+        recall = np.mean([
+            len(result & truth) / args.k for result, truth in zip(found, exact[metric])
+        ])
+        latencies.sort()
+        print(
+            f"{index_type:>6}/{metric:<6} size {size / 2 ** 20:7.2f} MiB, build {build_time:6.2f}s, "
+            f"p50 {latencies[len(latencies) // 2]:.3f} ms, recall@{args.k} {recall:.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Throughput of HFArtworkAnalyser: one review per generate call vs analyze_many batches, with the model
+loaded once. Each mode runs in its own process so that peak RSS is measured separately.
+
+    python -m benchmarks.llava_throughput --reviews 8 --batch-size 4 --max-new-tokens 200
+"""
+import argparse
+import json
+import random
+import resource
+import subprocess
+import sys
+import time
+
+from core.artwork_analysis import Artwork
+
+
+def sample_artworks(source, count):
+    with open(source, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    keys = [key for key in data if data[key].get("img_list")]
+    keys = random.Random(0).sample(keys, min(len(keys), 3 * count))
+    artworks = [Artwork(data[key], key) for key in keys]
+    return [(artworks[i], artworks[i + 1:i + 3]) for i in range(0, len(artworks) - 2, 3)]
+
+
+def run(args):
+    from core.artwork_analysis import HFArtworkAnalyser
+
+    pairs = sample_artworks(args.source, args.reviews)
+    start = time.perf_counter()
+    analyser = HFArtworkAnalyser(device=args.device)
+    load_time = time.perf_counter() - start
+    # images are fetched up front, so only generation is measured
+    analyser.images.fetch([artwork.images[0] for main, related in pairs for artwork in [main] + related])
+
+    start = time.perf_counter()
+    if args.mode == "sequential":
+        for main_artwork, related_artworks in pairs:
+            next(analyser.analyze_many([(main_artwork, related_artworks)], 1, args.max_new_tokens))
+    else:
+        for _ in analyser.analyze_many(pairs, args.batch_size, args.max_new_tokens):
+            pass
+    elapsed = time.perf_counter() - start
+    print(json.dumps({
+        "mode": args.mode,
+        "device": analyser.device,
+        "reviews": len(pairs),
+        "load_s": round(load_time, 2),
+        "generate_s": round(elapsed, 2),
+        "reviews_per_hour": round(len(pairs) / elapsed * 3600, 1),
+        "peak_rss_mib": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", default="ars_electronica_prizewinners_ru.json")
+    parser.add_argument("--reviews", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--max-new-tokens", type=int, default=200)
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--mode", choices=["sequential", "batched"], default=None)
+    args = parser.parse_args()
+
+    if args.mode:
+        run(args)
+        return
+    for mode in ("sequential", "batched"):
+        command = [sys.executable, "-m", "benchmarks.llava_throughput", "--mode", mode] + sys.argv[1:]
+        subprocess.run(command, check=True)
+
+
+if __name__ == "__main__":
+    main()
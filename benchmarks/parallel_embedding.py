@@ -0,0 +1,54 @@
+"""
+Embedding throughput of the corpus chunks in one process (HuggingFaceEmbeddings, as VectorDB embeds by default)
+and with ParallelEmbeddings on 1, 2, 4 and 8 workers: chunks per second, speedup over the single process and
+the largest difference to its vectors, which only comes from the different padding of the batches.
+Starting the pool and loading the models is timed apart from the embedding.
+
+    python -m benchmarks.parallel_embedding --source ars_electronica_prizewinners_ru.json --workers 1 2 4 8
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+from core.document_retrieval import VectorDB
+from core.parallel_embeddings import ParallelEmbeddings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", default="ars_electronica_prizewinners_ru.json")
+    parser.add_argument("--model", default="cointegrated/rubert-tiny2")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--limit", type=int, default=None, help="embed only the first N chunks")
+    args = parser.parse_args()
+
+    vector_db = VectorDB(args.source, model_path=args.model, cache_dir=None)
+    vector_db.load()
+    texts = [doc.page_content for doc in vector_db.docs][:args.limit]
+    print(f"{len(texts)} chunks, {os.cpu_count()} CPUs")
+
+    vector_db.init_embeddings()
+    start = time.perf_counter()
+    baseline = np.array(vector_db.embeddings.embed_documents(texts), dtype=np.float32)
+    single = time.perf_counter() - start
+    print(f"{'single process':>15}: {len(texts) / single:8.1f} chunks/s")
+
+    for workers in args.workers:
+        with ParallelEmbeddings(args.model, workers, args.batch_size) as embeddings:
+            start = time.perf_counter()
+            # a batch for every worker, so all of them are started and have loaded the model
+            embeddings.embed_documents(texts[:workers * args.batch_size + 1])
+            startup = time.perf_counter() - start
+            start = time.perf_counter()
+            vectors = np.array(embeddings.embed_documents(texts), dtype=np.float32)
+            elapsed = time.perf_counter() - start
+        difference = float(np.abs(vectors - baseline).max())
+        print(f"{workers:>7} workers: {len(texts) / elapsed:8.1f} chunks/s, speedup {single / elapsed:5.2f}, "
+              f"startup {startup:5.1f}s, max difference {difference:.1e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Chunk-list filtering vs per-record aggregation in Retriever.get_top_k: distinct artworks
+returned, recall@k against an exhaustive per-record search and query latency.
+
+    python -m benchmarks.record_retrieval --source ars_electronica_prizewinners_ru.json
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+
+from core.artwork_analysis import Artwork
+from core.document_retrieval import Retriever, VectorDB
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", default="ars_electronica_prizewinners_ru.json")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=2)
+    args = parser.parse_args()
+
+    vector_db = VectorDB(args.source)
+    vector_db.create_db()
+    with open(args.source, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    keys = random.Random(0).sample(list(data), min(args.queries, len(data)))
+    artworks = [Artwork(data[key], key) for key in keys]
+
+    vectors = vector_db.embeddings.embed_documents([artwork.description for artwork in artworks])
+    exact = vector_db.search_records(
+        vectors, args.k, [{key} for key in keys], fetch_k=vector_db.db.index.ntotal
+    )
+    exact = [{record_key for record_key, _, _ in records} for records in exact]
+
+    for mode in ("chunks", "records"):
+        retriever = Retriever(vector_db, mode=mode)
+        latencies, distinct, hits = [], [], 0
+        for artwork, relevant in zip(artworks, exact):
+            start = time.perf_counter()
+            docs = retriever.get_top_k(artwork.description, artwork.key, args.k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            found = {doc.metadata["key"] for doc in docs} - {artwork.key}
+            distinct.append(len(found))
+            hits += len(found & relevant)
+        short = sum(count < args.k for count in distinct)
+        print(
+            f"{mode:>8}: recall@{args.k} {hits / (args.k * len(artworks)):.3f}, "
+            f"mean distinct {statistics.mean(distinct):.2f}, fewer than k: {short}/{len(artworks)}, "
+            f"p50 {percentile(latencies, 0.5):.1f} ms, p99 {percentile(latencies, 0.99):.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
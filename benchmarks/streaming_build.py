@@ -0,0 +1,66 @@
+"""
+Peak Python memory (tracemalloc) of the in-memory build (load + split + embed everything at once)
+vs build_streaming on corpora made of 1, 2 and 4 copies of the source. The index and its chunk ids grow
+with the corpus in both cases; the difference is the transient lists of records, documents and vectors.
+
+    python -m benchmarks.streaming_build --source ars_electronica_prizewinners_ru.json
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from core.corpus import CorpusStore
+from core.document_retrieval import VectorDB
+
+
+def measure(vector_db, streaming):
+    tracemalloc.start()
+    start = time.perf_counter()
+    if streaming:
+        vector_db.build_streaming()
+    else:
+        vector_db.build()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", default="ars_electronica_prizewinners_ru.json")
+    parser.add_argument("--copies", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    with open(args.source, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    embeddings = None
+    with tempfile.TemporaryDirectory() as tmp:
+        for copies in args.copies:
+            json_path = os.path.join(tmp, f"corpus_{copies}.json")
+            with open(json_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    {f"{key}_{i}": record for i in range(copies) for key, record in data.items()},
+                    f, ensure_ascii=False,
+                )
+            store_path = os.path.join(tmp, f"corpus_{copies}.sqlite")
+            CorpusStore.import_json(json_path, store_path)
+
+            for name, path, streaming in [("in-memory", json_path, False), ("streaming", store_path, True)]:
+                vector_db = VectorDB(path, cache_dir=None)
+                if embeddings is None:
+                    vector_db.init_embeddings()
+                    embeddings = vector_db.embeddings
+                vector_db.embeddings = embeddings
+                elapsed, peak = measure(vector_db, streaming)
+                print(
+                    f"{copies}x {name:>9}: {vector_db.db.index.ntotal} vectors in {elapsed:.1f}s, "
+                    f"peak {peak:.1f} MiB"
+                )
+
+
+if __name__ == "__main__":
+    main()
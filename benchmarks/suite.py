@@ -0,0 +1,425 @@
+"""
+The benchmark suite of the hot paths: corpus load, splitting, embedding throughput, index build, query latency
+and recall@k against the exact search, prompt building, post formatting, the cost of an instrumentation span, and post generation and delivery against
+the local stand-ins of the OpenAI and Telegram APIs (benchmarks.fake_servers).
+
+By default it runs on the fixture corpus with hashing embeddings, so no model, key or network is needed and
+the numbers of two commits on one machine are comparable. Results are written as JSON; with --baseline the
+metrics that got worse than the tolerance are listed and the run fails.
+
+    python -m benchmarks --output .cache/benchmarks/$(git rev-parse --short HEAD).json
+    python -m benchmarks --baseline .cache/benchmarks/<previous commit>.json
+    python -m benchmarks --source ars_electronica_prizewinners_ru.json --embeddings model --only embedding query
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from typing import Dict, List
+
+import faiss
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from benchmarks.fake_servers import FakeOpenAI, FakeTelegram
+from benchmarks.record_retrieval import percentile
+from core.artwork_analysis import Artwork, ArtworkAnalyser, ArtworkRetriever, AsyncArtworkAnalyser
+from core.corpus import open_corpus
+from core.delivery import Delivery
+from core.document_retrieval import Retriever, VectorDB
+from core.instrumentation import Instrumentation
+from core.lexical import BM25Index, tokenize
+from core.post_queue import PostQueue, generate_posts
+from main import deliver, prepare_post, with_review
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "corpus.json")
+TOKEN = "123456:fake"
+REVIEW = (
+    "**Memory Camera Algorithm** и **Light Swarm** говорят о памяти машин, но по-разному: "
+    "первая работа _собирает_ следы, вторая их стирает. " * 12
+)
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Stems of the text hashed into `size` signed buckets. Deterministic and needs no model, while texts sharing
+    names and words stay close, which is what the index and the retrieval around it are benchmarked on
+    """
+
+    def __init__(self, size=312):
+        self.size = size
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = np.zeros((len(texts), self.size), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in tokenize(text):
+                bucket = zlib.crc32(token.encode("utf-8"))
+                vectors[row, bucket % self.size] += 1.0 if bucket >> 31 else -1.0
+        return vectors.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class PrecomputedEmbeddings(Embeddings):
+    """
+    Returns the already computed vectors of known texts, so that an index build is timed without embedding
+    """
+
+    def __init__(self, embeddings: Embeddings, texts: List[str], vectors: np.ndarray):
+        self.embeddings = embeddings
+        self.vectors = dict(zip(texts, vectors.tolist()))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        missing = [text for text in texts if text not in self.vectors]
+        if missing:
+            self.vectors.update(zip(missing, self.embeddings.embed_documents(missing)))
+        return [self.vectors[text] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class SuiteArtworkRetriever(ArtworkRetriever):
+    """
+    ArtworkRetriever over an index built by the suite instead of the cached one of the source
+    """
+
+    def __init__(self, source, vector_db, mode="hybrid"):
+        self.suite_vector_db = vector_db
+        super().__init__(source, mode=mode)
+
+    def init_vector_db(self):
+        return self.suite_vector_db
+
+
+def latency_metrics(latencies_ms: List[float]) -> Dict[str, float]:
+    return {"p50_ms": percentile(latencies_ms, 0.5), "p99_ms": percentile(latencies_ms, 0.99)}
+
+
+def median_ms(function, repeat=5):
+    """
+    Median wall time of `repeat` calls in milliseconds
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+class Suite:
+    """
+    Every benchmark is a method returning {result name: {metric: value}}; later ones reuse the corpus, chunks and
+    vectors of the earlier ones, which are computed on first use. Metric names end with the unit: _ms and _us
+    are better lower, per_s and recall better higher, the others are counts that are not compared
+    """
+
+    BENCHMARKS = ("corpus_load", "split", "embedding", "index_build", "query", "prompt", "formatting",
+                  "instrumentation", "generation", "delivery")
+
+    def __init__(self, source=FIXTURE, embeddings="hashing", index_types=("flat", "sq8", "ivfpq"), queries=100,
+                 k=2, posts=20, latency=0.02, concurrency=8):
+        self.source = source
+        self.embeddings_name = embeddings
+        self.index_types = index_types
+        self.queries = queries
+        self.k = k
+        self.posts = posts
+        self.latency = latency
+        self.concurrency = concurrency
+        self._data = None
+        self._vector_db = None
+        self._embeddings = None
+        self._vectors = None
+        self._indexes = {}
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = open_corpus(self.source)
+        return self._data
+
+    @property
+    def vector_db(self) -> VectorDB:
+        """
+        The corpus loaded and split into chunks, without an index
+        """
+        if self._vector_db is None:
+            self._vector_db = VectorDB(self.source, cache_dir=None)
+            self._vector_db.load()
+        return self._vector_db
+
+    @property
+    def embeddings(self) -> Embeddings:
+        if self._embeddings is None:
+            if self.embeddings_name == "hashing":
+                self._embeddings = HashingEmbeddings()
+            else:
+                self.vector_db.init_embeddings()
+                self._embeddings = self.vector_db.embeddings
+        return self._embeddings
+
+    @property
+    def vectors(self) -> np.ndarray:
+        if self._vectors is None:
+            texts = [doc.page_content for doc in self.vector_db.docs]
+            self._vectors = np.array(self.embeddings.embed_documents(texts), dtype=np.float32)
+        return self._vectors
+
+    def index(self, index_type) -> VectorDB:
+        """
+        VectorDB of the given index type built through VectorDB.build from the precomputed vectors
+        """
+        if index_type not in self._indexes:
+            vector_db = VectorDB(self.source, cache_dir=None, index_type=index_type)
+            vector_db.load()
+            texts = [doc.page_content for doc in self.vector_db.docs]
+            vector_db.embeddings = PrecomputedEmbeddings(self.embeddings, texts, self.vectors)
+            start = time.perf_counter()
+            vector_db.build()
+            vector_db.build_ms = (time.perf_counter() - start) * 1000
+            self._indexes[index_type] = vector_db
+        return self._indexes[index_type]
+
+    def query_keys(self) -> List[str]:
+        return random.Random(0).sample(list(self.data), min(self.queries, len(self.data)))
+
+    def corpus_load(self):
+        ms = median_ms(lambda: len(open_corpus(self.source)))
+        return {"corpus_load": {"ms": ms, "records": len(self.data)}}
+
+    def split(self):
+        vector_db = VectorDB(self.source, cache_dir=None)
+        ms = median_ms(vector_db.load)
+        return {"split": {"ms": ms, "records": len(vector_db.records), "chunks": len(vector_db.docs)}}
+
+    def embedding(self):
+        texts = [doc.page_content for doc in self.vector_db.docs]
+        start = time.perf_counter()
+        self._vectors = np.array(self.embeddings.embed_documents(texts), dtype=np.float32)
+        seconds = time.perf_counter() - start
+        return {"embedding": {"chunks_per_s": len(texts) / seconds, "chunks": len(texts),
+                              "dimensions": self._vectors.shape[1]}}
+
+    def index_build(self):
+        results = {}
+        for index_type in self.index_types:
+            vector_db = self.index(index_type)
+            results[f"index_build/{index_type}"] = {
+                "build_ms": vector_db.build_ms,
+                "size_kib": len(faiss.serialize_index(vector_db.db.index)) / 1024,
+            }
+        return results
+
+    def query(self):
+        """
+        Retriever.get_top_k as the retriever calls it (query text embedded, the query record excluded) with
+        recall@k against an exhaustive search of the flat index, then the hybrid mode over the flat index
+        """
+        keys = self.query_keys()
+        artworks = [Artwork(self.data[key], key) for key in keys]
+        exact_db = self.index("flat")
+        vectors = self.embeddings.embed_documents([artwork.description for artwork in artworks])
+        exact = exact_db.search_records(vectors, self.k, [{key} for key in keys], fetch_k=exact_db.db.index.ntotal)
+        exact = [{key for key, _, _ in records} for records in exact]
+
+        results = {}
+        lexical = BM25Index.build(self.data.items())
+        retrievers = [(index_type, Retriever(self.index(index_type))) for index_type in self.index_types]
+        retrievers.append(("hybrid", Retriever(exact_db, "hybrid", lexical=lexical)))
+        for name, retriever in retrievers:
+            latencies, recalls = [], []
+            for artwork, truth in zip(artworks, exact):
+                start = time.perf_counter()
+                docs = retriever.get_top_k(artwork.description, artwork.key, self.k)
+                latencies.append((time.perf_counter() - start) * 1000)
+                recalls.append(len({doc.metadata["key"] for doc in docs} & truth) / max(1, len(truth)))
+            # hybrid results differ from the vector ones by design, their overlap is reported but not compared
+            metric = "vector_overlap" if name == "hybrid" else "recall"
+            results[f"query/{name}"] = {**latency_metrics(latencies), metric: statistics.mean(recalls)}
+        return results
+
+    def prompt(self):
+        keys = list(self.data)
+        artworks = [Artwork(self.data[key], key) for key in keys]
+        triples = [(artworks[i], [artworks[i - 1], artworks[i - 2]]) for i in range(len(artworks))]
+
+        def build():
+            for main_artwork, related_artworks in triples:
+                prompt = ArtworkAnalyser.create_prompt(main_artwork, related_artworks)
+                ArtworkAnalyser.create_messages(prompt, ArtworkAnalyser.get_images(main_artwork, related_artworks))
+
+        return {"prompt": {"us": median_ms(build) * 1000 / len(triples)}}
+
+    def formatting(self):
+        items = list(self.data.items())
+
+        def format_posts():
+            for key, artwork in items:
+                prepare_post(key, artwork, REVIEW)
+
+        return {"formatting": {"us": median_ms(format_posts) * 1000 / len(items)}}
+
+    def instrumentation(self, spans=20000):
+        """
+        A span with labels when instrumentation is off and when it writes JSON lines and keeps totals
+        """
+        results = {}
+        with tempfile.TemporaryDirectory() as tmp:
+            for name, jsonl_path in [("off", None), ("jsonl", os.path.join(tmp, "metrics.jsonl"))]:
+                instrumentation = Instrumentation()
+                instrumentation.configure(jsonl_path)
+
+                def run():
+                    for _ in range(spans):
+                        with instrumentation.span("stage", step="message"):
+                            pass
+
+                results[f"instrumentation/{name}"] = {"span_us": median_ms(run, repeat=3) * 1000 / spans}
+                if instrumentation.jsonl:
+                    instrumentation.jsonl.close()
+        return results
+
+    def generation(self):
+        """
+        generate_posts with the hybrid ArtworkRetriever over the flat index and AsyncArtworkAnalyser against
+        FakeOpenAI answering after `latency` seconds
+        """
+        keys = self.query_keys()[:self.posts]
+        artwork_retriever = SuiteArtworkRetriever(self.source, self.index("flat"))
+        with FakeOpenAI(latency=self.latency) as fake, tempfile.TemporaryDirectory() as tmp:
+            analyser = AsyncArtworkAnalyser("test", concurrency=self.concurrency, base_url=fake.base_url)
+            queue = PostQueue(os.path.join(tmp, "post_queue.jsonl"))
+            start = time.perf_counter()
+            posts = asyncio.run(
+                generate_posts(keys, self.data, artwork_retriever, analyser, prepare_post, queue, with_review)
+            )
+            seconds = time.perf_counter() - start
+        return {"generation": {"posts_per_s": len(posts) / seconds, "posts": len(posts),
+                               "lost": len(keys) - len(posts), "retries": analyser.retries}}
+
+    def delivery(self):
+        """
+        Posts sent one after another with a shared Delivery to FakeTelegram answering after `latency` seconds
+        """
+        keys = self.query_keys()[:self.posts]
+        posts = [prepare_post(key, self.data[key], REVIEW) for key in keys]
+
+        async def send(base_url):
+            latencies = []
+            async with Delivery(TOKEN, base_url=base_url) as delivery:
+                for post in posts:
+                    start = time.perf_counter()
+                    await deliver(delivery, post, ["@benchmark"])
+                    latencies.append((time.perf_counter() - start) * 1000)
+                return latencies, delivery.stats()
+
+        with FakeTelegram(latency=self.latency) as fake:
+            latencies, stats = asyncio.run(send(fake.base_url))
+            messages = len(fake.messages)
+        return {"delivery": {**latency_metrics(latencies), "messages": messages, "retries": stats["retries"]}}
+
+    def run(self, names=BENCHMARKS) -> Dict[str, Dict[str, float]]:
+        results = {}
+        for name in self.BENCHMARKS:
+            if name not in names:
+                continue
+            start = time.perf_counter()
+            for result_name, metrics in getattr(self, name)().items():
+                results[result_name] = metrics
+                print(f"{result_name:>22}: " + ", ".join(f"{metric} {value:.4g}" for metric, value in metrics.items()))
+            print(f"{'':>22}  ({name} took {time.perf_counter() - start:.1f}s)")
+        return results
+
+
+def direction(metric: str) -> int:
+    """
+    1 if a higher value of the metric is better, -1 if a lower one is, 0 if it is not compared
+    """
+    if metric.endswith("per_s") or metric == "recall":
+        return 1
+    if metric in ("ms", "us") or metric.endswith(("_ms", "_us")):
+        return -1
+    return 0
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[tuple]:
+    """
+    (result name, metric, baseline value, value) of the metrics worse than the baseline by more than tolerance,
+    a fraction of the baseline value
+    """
+    regressions = []
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            before = baseline.get(name, {}).get(metric)
+            sign = direction(metric)
+            if before is None or not sign:
+                continue
+            if sign * (value - before) < -tolerance * abs(before):
+                regressions.append((name, metric, before, value))
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", default=FIXTURE)
+    parser.add_argument("--embeddings", choices=["hashing", "model"], default="hashing",
+                        help="hashing needs no model; model is the VectorDB sentence-transformers model")
+    parser.add_argument("--index-types", nargs="+", default=["flat", "sq8", "ivfpq"])
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("-k", type=int, default=2)
+    parser.add_argument("--posts", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds per fake OpenAI and Bot API request")
+    parser.add_argument("--only", nargs="+", choices=Suite.BENCHMARKS, default=list(Suite.BENCHMARKS))
+    parser.add_argument("--output", help="JSON results path, .cache/benchmarks/<commit>.json by default")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="fraction by which a metric may be worse than the baseline")
+    args = parser.parse_args()
+
+    suite = Suite(args.source, args.embeddings, args.index_types, args.queries, args.k, args.posts, args.latency)
+    results = suite.run(args.only)
+
+    commit = git_commit()
+    output = args.output or os.path.join(".cache", "benchmarks", f"{commit or 'results'}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "commit": commit,
+            "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": vars(args),
+            "results": results,
+        }, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline["results"], args.tolerance)
+        for name, metric, before, value in regressions:
+            print(f"Regression in {name} {metric}: {before:.4g} -> {value:.4g}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {baseline.get('commit') or args.baseline}")
@@ -0,0 +1,41 @@
+"""
+Cold vs warm startup of VectorDB: the first run embeds the corpus and writes the cache,
+the second one reads the index back from disk.
+
+    python -m benchmarks.vector_cache --source ars_electronica_prizewinners_ru.json
+"""
+import argparse
+import tempfile
+import time
+
+from core.document_retrieval import VectorDB
+
+
+def timed_create_db(source, cache_dir):
+    vector_db = VectorDB(source, cache_dir=cache_dir)
+    start = time.perf_counter()
+    vector_db.init_embeddings()
+    embeddings_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vector_db.create_db()
+    index_time = time.perf_counter() - start
+    return embeddings_time, index_time, vector_db.db.index.ntotal
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", default="ars_electronica_prizewinners_ru.json")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for run in ("cold", "warm"):
+            embeddings_time, index_time, ntotal = timed_create_db(args.source, cache_dir)
+            print(
+                f"{run}: model load {embeddings_time:.2f}s, index {index_time:.2f}s, "
+                f"total {embeddings_time + index_time:.2f}s ({ntotal} vectors)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import argparse
+import time
+
+from core.artwork_analysis import Artwork
+from core.corpus import default_source
+from core.document_retrieval import JSONDocumentLoader, VectorDB
+from core.lexical import BM25Index
+from core.neighbours import NeighbourTable, build_neighbour_table
+
+# the embedding workers of --workers re-import this module, so the script only runs as __main__
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precomputes related artworks for every key of the corpus')
+    # the source main.py reads, the table is only used with the source it was built from
+    parser.add_argument('--source', default=default_source())
+    parser.add_argument('--output', default='neighbours.json')
+    parser.add_argument('-k', type=int, default=5)
+    parser.add_argument('--mode', choices=['records', 'hybrid'], default='hybrid',
+                        help='hybrid fuses the vector neighbours with a BM25 index of the corpus')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='processes embedding the corpus and the queries on CPU')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with VectorDB(args.source, workers=args.workers) as vector_db:
+        vector_db.create_db()
+        lexical = BM25Index.from_corpus(args.source) if args.mode == 'hybrid' else None
+        print(f'Index ready in {time.perf_counter() - start:.2f}s')
+
+        # the same query text as ArtworkRetriever.get_related_artworks uses online
+        data = JSONDocumentLoader(args.source).read()
+        queries = {key: Artwork(data[key]).description for key in data}
+
+        start = time.perf_counter()
+        table = build_neighbour_table(vector_db, queries, k=args.k, lexical=lexical)
+        print(f'Neighbours for {len(table)} keys computed in {time.perf_counter() - start:.2f}s')
+
+    NeighbourTable.save(args.output, table, args.source)
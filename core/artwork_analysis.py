@@ -1,17 +1,21 @@
-import requests
-import torch
-from PIL import Image
+import asyncio
+import io
+import random
+import re
+import time
+
 from dotenv import load_dotenv
-from openai import OpenAI
-from transformers import LlavaNextProcessor, LlavaNextForConditionalGeneration
 
-from core.document_retrieval import VectorDB, Retriever
+from core.corpus import open_corpus
+from core.instrumentation import metrics
+from core.neighbours import NeighbourTable
 
 load_dotenv()
 
 
 class Artwork:
-    def __init__(self, metadata):
+    def __init__(self, metadata, key=None):
+        self.key = key or metadata.get("key")
         self.name = metadata.get("name")
         self.authors = metadata.get("authors")
         self.year = metadata.get("year")
@@ -22,77 +26,151 @@ class Artwork:
     def delete_apostrophe(text):
         return text.replace("'", "")
 
+    @classmethod
+    def from_corpus(cls, corpus, key):
+        return cls(corpus[key], key)
+
     def __str__(self):
         return self.name
 
 
 class ArtworkRetriever:
-    def __init__(self, source):
+    """
+    With neighbours_path, related artworks are taken from the precomputed NeighbourTable and
+    the vector index is only built for keys missing from it. A table built from another version
+    of the source is ignored. mode is the Retriever mode,
+    "hybrid" also loads the BM25 index of the corpus
+    """
+
+    def __init__(self, source, neighbours_path=None, mode="records"):
         self.source = source
+        self.mode = mode
+        self.vector_db = None
+        self.retriever = None
+        self.neighbours = None
+        self.data = None
+        if neighbours_path:
+            self.neighbours = NeighbourTable(neighbours_path)
+            if not self.neighbours.is_current(source):
+                print(f"{neighbours_path} was built from another version of {source}, run build-neighbours.py")
+                self.neighbours = None
+        if self.neighbours:
+            self.data = open_corpus(source)
+        else:
+            self.init_retriever()
+
+    def init_retriever(self):
+        from core.document_retrieval import Retriever
+
         self.vector_db = self.init_vector_db()
-        self.retriever = Retriever(self.vector_db)
+        lexical = None
+        if self.mode == "hybrid":
+            from core.lexical import BM25Index
+
+            with metrics.span("bm25_load"):
+                lexical = BM25Index.from_corpus(self.source)
+        self.retriever = Retriever(self.vector_db, self.mode, lexical=lexical)
 
     def init_vector_db(self):
+        from core.document_retrieval import VectorDB
+
         vector_db = VectorDB(self.source)
-        vector_db.load()
         vector_db.create_db()
         return vector_db
 
-    def get_related_artworks(self, main_artwork, k=2):
+    def get_related_artworks(self, main_artwork, k=2, where=None):
+        """
+        where restricts the related artworks by metadata for themed weeks, e.g. {"category": "Hybrid Art"}
+        or {"year": (None, 1999)}, see VectorDB.search_records. Filtered queries skip the neighbour table
+        """
+        if self.neighbours and main_artwork.key in self.neighbours and not where:
+            return [
+                Artwork.from_corpus(self.data, key)
+                for key in self.neighbours.get(main_artwork.key, k)
+            ]
+        if not self.retriever:
+            self.init_retriever()
         related_artworks_data = self.retriever.get_top_k(
-            main_artwork.description, main_artwork.name, k
+            main_artwork.description, main_artwork.key, k, where
         )
         return [Artwork(doc.metadata) for doc in related_artworks_data]
 
 
 class ArtworkAnalyser:
-    def __init__(self, api_key):
+    """
+    With a ResponseCache, a review is requested only once per model, prompt and image set.
+    With an ImagePipeline, images are sent inline as base64 instead of URLs the API has to fetch.
+    Token usage and its cost at `prices` are counted in core.instrumentation
+    """
+
+    model = "gpt-4o"
+    # USD per million prompt and completion tokens of the model: the gpt-4o alias points to the
+    # gpt-4o-2024-08-06 snapshot, the original gpt-4o-2024-05-13 costs (5.0, 15.0)
+    prices = (2.5, 10.0)
+
+    def __init__(self, api_key, cache=None, images=None):
+        from openai import OpenAI
+
         self.client = OpenAI(api_key=api_key)
+        self.cache = cache
+        self.images = images
 
     def analyze_artworks(self, main_artwork, related_artworks):
         prompt = self.create_prompt(main_artwork, related_artworks)
-        print('Prompt: ', prompt)
-        images = [main_artwork.images[0]] + [
+        images = self.get_images(main_artwork, related_artworks)
+        cache_key = self.cache.key(self.model, prompt, images) if self.cache else None
+        if cache_key:
+            review = self.cache.get(cache_key)
+            if review is not None:
+                metrics.count("review_cache_hits")
+                return review
+        messages = self.create_messages(prompt, self.image_inputs(images))
+        with metrics.span("openai", model=self.model, prompt_chars=len(prompt), images=len(images)):
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                max_tokens=2000,
+            )
+        self.count_usage(response.usage)
+        review = response.choices[0].message.content
+        if cache_key:
+            self.cache.set(cache_key, review)
+        return review
+
+    @staticmethod
+    def get_images(main_artwork, related_artworks):
+        return [main_artwork.images[0]] + [
             artwork.images[0] for artwork in related_artworks
         ]
-        print('Images: ', images)
-        response = self.client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
+
+    def count_usage(self, usage):
+        if usage is None:
+            return
+        metrics.count("openai_prompt_tokens", usage.prompt_tokens)
+        metrics.count("openai_completion_tokens", usage.completion_tokens)
+        prompt_price, completion_price = self.prices
+        metrics.count("openai_cost_usd",
+                      (usage.prompt_tokens * prompt_price + usage.completion_tokens * completion_price) / 1e6)
+
+    def image_inputs(self, images):
+        if not self.images:
+            return images
+        return self.images.get_many(images, "model", as_data_url=True)
+
+    @staticmethod
+    def create_messages(prompt, images):
+        content = [{"type": "text", "text": prompt}]
+        for image in images:
+            content.append(
                 {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": prompt,
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": images[0],
-                                "detail": "low"
-                            },
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": images[1],
-                                "detail": "low"
-                            },
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": images[2],
-                                "detail": "low"
-                            },
-                        },
-                    ],
+                    "type": "image_url",
+                    "image_url": {
+                        "url": image,
+                        "detail": "low"
+                    },
                 }
-            ],
-            max_tokens=2000,
-        )
-        return response.choices[0].message.content
+            )
+        return [{"role": "user", "content": content}]
 
     @staticmethod
     def create_prompt(main_artwork, related_artworks):
@@ -116,34 +194,194 @@ class ArtworkAnalyser:
         return prompt
 
 
+class AsyncArtworkAnalyser(ArtworkAnalyser):
+    """
+    ArtworkAnalyser for generating many reviews at once: at most `concurrency` requests are in flight,
+    rate limit, connection and server errors are retried with exponential backoff or the delay
+    the API asks for, and all requests pause when the rate limit headers report an exhausted quota
+    """
+
+    def __init__(self, api_key, concurrency=4, max_retries=5, base_url=None, cache=None, images=None):
+        from openai import AsyncOpenAI
+
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+        self.cache = cache
+        self.images = images
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.max_retries = max_retries
+        self.retries = 0
+        # monotonic time before which no request is sent
+        self.resume_at = 0.0
+
+    async def analyze_artworks(self, main_artwork, related_artworks):
+        import openai
+
+        prompt = self.create_prompt(main_artwork, related_artworks)
+        images = self.get_images(main_artwork, related_artworks)
+        cache_key = self.cache.key(self.model, prompt, images) if self.cache else None
+        if cache_key:
+            review = self.cache.get(cache_key)
+            if review is not None:
+                metrics.count("review_cache_hits")
+                return review
+        messages = self.create_messages(prompt, await asyncio.to_thread(self.image_inputs, images))
+        async with self.semaphore:
+            for attempt in range(self.max_retries + 1):
+                await asyncio.sleep(max(0.0, self.resume_at - time.monotonic()))
+                try:
+                    with metrics.span("openai", model=self.model, attempt=attempt):
+                        raw_response = await self.client.chat.completions.with_raw_response.create(
+                            model=self.model,
+                            messages=messages,
+                            max_tokens=2000,
+                        )
+                except (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError) as e:
+                    if attempt == self.max_retries:
+                        raise
+                    self.retries += 1
+                    metrics.count("openai_retries", error=type(e).__name__)
+                    response = getattr(e, "response", None)
+                    delay = retry_after(response.headers) if response is not None else None
+                    if delay is None:
+                        delay = min(60.0, 2 ** attempt) * random.uniform(0.5, 1.0)
+                    if isinstance(e, openai.RateLimitError):
+                        self.resume_at = max(self.resume_at, time.monotonic() + delay)
+                    await asyncio.sleep(delay)
+                    continue
+                self.track_rate_limit(raw_response.headers)
+                response = raw_response.parse()
+                self.count_usage(response.usage)
+                review = response.choices[0].message.content
+                if cache_key:
+                    self.cache.set(cache_key, review)
+                return review
+
+    def track_rate_limit(self, headers):
+        for kind in ("requests", "tokens"):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            reset = headers.get(f"x-ratelimit-reset-{kind}")
+            if remaining is not None and reset is not None and int(remaining) == 0:
+                self.resume_at = max(self.resume_at, time.monotonic() + parse_duration(reset))
+
+
+def retry_after(headers):
+    """
+    Delay in seconds requested by the retry-after-ms or retry-after headers, if any
+    """
+    if headers.get("retry-after-ms"):
+        return float(headers["retry-after-ms"]) / 1000
+    if headers.get("retry-after"):
+        try:
+            return float(headers["retry-after"])
+        except ValueError:
+            return None
+    return None
+
+
+def parse_duration(text):
+    """
+    Parses rate limit reset durations like "1s", "6m0s" or "20ms" into seconds
+    """
+    units = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    return sum(
+        float(value) * units[unit]
+        for value, unit in re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", text)
+    )
+
+
 class HFArtworkAnalyser:
-    def __init__(self, model_name='llava-hf/llava-v1.6-mistral-7b-hf'):
-        self.processor = LlavaNextProcessor.from_pretrained(model_name)
-        self.model = LlavaNextForConditionalGeneration.from_pretrained(
-            model_name,
-            torch_dtype=torch.float16,
-            low_cpu_mem_usage=True,
-            load_in_4bit=True,
-            # use_flash_attention_2=True,
-        )
+    """
+    LLaVA-NeXT reviews. The model stays loaded for the lifetime of the object, so analyze_many can
+    generate a backlog of reviews in padded batches. Without a GPU the model runs on CPU in float32,
+    4-bit quantization is used on CUDA only
+    """
+
+    def __init__(self, model_name='llava-hf/llava-v1.6-mistral-7b-hf', cache=None, images=None, device=None):
+        import torch
+        from transformers import LlavaNextProcessor, LlavaNextForConditionalGeneration
+
+        from core.image_pipeline import ImagePipeline
+
+        self.model_name = model_name
+        self.cache = cache
+        self.images = images or ImagePipeline()
+        self.device = device or ("cuda:0" if torch.cuda.is_available() else "cpu")
+        with metrics.span("model_load", model=model_name, device=self.device):
+            self.processor = LlavaNextProcessor.from_pretrained(model_name)
+            # batched prompts are padded on the left, so generation continues right after each prompt
+            self.processor.tokenizer.padding_side = "left"
+            if self.processor.tokenizer.pad_token is None:
+                self.processor.tokenizer.pad_token = self.processor.tokenizer.unk_token
+            if self.device.startswith("cuda"):
+                self.model = LlavaNextForConditionalGeneration.from_pretrained(
+                    model_name,
+                    torch_dtype=torch.float16,
+                    low_cpu_mem_usage=True,
+                    load_in_4bit=True,
+                    # use_flash_attention_2=True,
+                )
+            else:
+                self.model = LlavaNextForConditionalGeneration.from_pretrained(
+                    model_name,
+                    torch_dtype=torch.float32,
+                    low_cpu_mem_usage=True,
+                ).to(self.device)
+            self.model.eval()
 
     def analyze_artworks(self, main_artwork, related_artworks):
-        prompt = self.create_prompt(main_artwork, related_artworks)
+        _, review = next(self.analyze_many([(main_artwork, related_artworks)]))
+        return review
+
+    def analyze_many(self, artworks, batch_size=4, max_new_tokens=1000):
+        """
+        Generates reviews for (main_artwork, related_artworks) pairs with batch_size prompts per generate
+        call and yields (pair index, review) as soon as they are ready, cached reviews first
+        """
+        import torch
+        from PIL import Image
 
-        images_urls = [main_artwork.images[0]] + [artwork.images[0] for artwork in related_artworks]
-        print('Images: ', images_urls)
-        images = []
-        for url in images_urls:
-            image = Image.open(requests.get(url, stream=True).raw)
-            # Resize the image to the required size for the model; you might need to adjust this size
-            image = image.resize((256, 256))
-            images.append(image)
+        pending = []
+        for index, (main_artwork, related_artworks) in enumerate(artworks):
+            prompt = self.create_prompt(main_artwork, related_artworks)
+            images_urls = [main_artwork.images[0]] + [artwork.images[0] for artwork in related_artworks]
+            cache_key = self.cache.key(self.model_name, prompt, images_urls) if self.cache else None
+            if cache_key:
+                review = self.cache.get(cache_key)
+                if review is not None:
+                    yield index, review
+                    continue
+            pending.append((index, prompt, images_urls, cache_key))
 
-        full_prompt = "[INST] " + "\n".join(["<image>"] * len(images)) + "\n" + prompt + " [/INST]"
-        inputs = self.processor(full_prompt, images=images, return_tensors="pt").to("cuda:0")
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            self.images.fetch([url for _, _, images_urls, _ in batch for url in images_urls])
+            prompts, images = [], []
+            for _, prompt, images_urls, _ in batch:
+                artwork_images = []
+                for content in self.images.get_many(images_urls, "model"):
+                    image = Image.open(io.BytesIO(content))
+                    # Resize the image to the required size for the model; you might need to adjust this size
+                    artwork_images.append(image.resize((256, 256)))
+                prompts.append(
+                    "[INST] " + "\n".join(["<image>"] * len(artwork_images)) + "\n" + prompt + " [/INST]"
+                )
+                images.extend(artwork_images)
 
-        output = self.model.generate(**inputs, max_new_tokens=1000)
-        return self.processor.decode(output[0], skip_special_tokens=True)
+            inputs = self.processor(
+                prompts, images=images or None, padding=True, return_tensors="pt"
+            ).to(self.device)
+            with torch.inference_mode(), metrics.span("llava_generate", batch=len(batch)):
+                output = self.model.generate(
+                    **inputs,
+                    max_new_tokens=max_new_tokens,
+                    pad_token_id=self.processor.tokenizer.pad_token_id,
+                )
+            metrics.count("llava_generated_tokens", (output.shape[1] - inputs["input_ids"].shape[1]) * len(batch))
+            reviews = self.processor.batch_decode(output, skip_special_tokens=True)
+            for (index, _, _, cache_key), review in zip(batch, reviews):
+                if cache_key:
+                    self.cache.set(cache_key, review)
+                yield index, review
 
     @staticmethod
     def create_prompt(main_artwork, related_artworks):
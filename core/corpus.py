@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+import sqlite3
+from collections.abc import Mapping
+from typing import Iterator, Tuple, Union
+
+
+class CorpusStore(Mapping):
+    """
+    Read-only view of the corpus in SQLite: a record is parsed only when its key is looked up,
+    and iteration streams records in the order of the source JSON. Created by import_json
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+    @classmethod
+    def import_json(cls, json_path: str, path: str) -> "CorpusStore":
+        with open(json_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        tmp_path = path + ".tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        connection = sqlite3.connect(tmp_path)
+        with connection:
+            connection.execute(
+                "CREATE TABLE records (id INTEGER PRIMARY KEY, key TEXT UNIQUE NOT NULL, record TEXT NOT NULL)"
+            )
+            connection.executemany(
+                "INSERT INTO records (key, record) VALUES (?, ?)",
+                ((key, json.dumps(record, ensure_ascii=False)) for key, record in data.items()),
+            )
+        connection.close()
+        os.replace(tmp_path, path)
+        return cls(path)
+
+    def __getitem__(self, key: str) -> dict:
+        row = self.connection.execute("SELECT record FROM records WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row[0])
+
+    def __contains__(self, key) -> bool:
+        return self.connection.execute("SELECT 1 FROM records WHERE key = ?", (key,)).fetchone() is not None
+
+    def __iter__(self) -> Iterator[str]:
+        for (key,) in self.connection.execute("SELECT key FROM records ORDER BY id"):
+            yield key
+
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def items(self, start=0) -> Iterator[Tuple[str, dict]]:
+        """
+        (key, record) pairs in source order, skipping the first `start` records without parsing them
+        """
+        rows = self.connection.execute(
+            "SELECT key, record FROM records ORDER BY id LIMIT -1 OFFSET ?", (start,)
+        )
+        for key, record in rows:
+            yield key, json.loads(record)
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def is_corpus_store(path: str) -> bool:
+    return os.path.splitext(path)[1] in (".sqlite", ".db")
+
+
+def default_source(name: str = "ars_electronica_prizewinners_ru") -> str:
+    """
+    The SQLite store made by import-corpus.py, which avoids parsing the whole JSON on every run,
+    or the JSON when there is none
+    """
+    source = f"{name}.sqlite"
+    return source if os.path.exists(source) else f"{name}.json"
+
+
+def open_corpus(path: str) -> Union[CorpusStore, dict]:
+    """
+    CorpusStore for .sqlite/.db files, the parsed JSON otherwise. Both are looked up with corpus[key]
+    """
+    if is_corpus_store(path):
+        return CorpusStore(path)
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
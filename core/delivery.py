@@ -0,0 +1,169 @@
+import asyncio
+import random
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional, Union
+
+import telegram
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+from telegram.request import HTTPXRequest
+
+from core.formatter import MAX_CAPTION_LENGTH
+from core.image_pipeline import ImagePipeline
+from core.instrumentation import metrics
+
+
+class DeliveryError(Exception):
+    """
+    A step of a post failed after its retries. `sent` holds the message ids of the steps that were
+    delivered, and None for a step that timed out and may have been published; passing it back to
+    Delivery.deliver resumes the post without sending either again
+    """
+
+    def __init__(self, chat_id: str, step: str, sent: Dict[str, Optional[List[int]]], cause: Exception):
+        super().__init__(f"{step} to {chat_id} failed: {cause!r}")
+        self.chat_id = chat_id
+        self.step = step
+        self.sent = sent
+        self.cause = cause
+
+
+class Delivery:
+    """
+    Sends prepared posts (see main.prepare_post) with one initialised Bot and a pooled HTTP connection.
+    A post is sent in steps: the message (as a photo caption when it is short), the media group
+    of a long message, and the review. Photos are prepared in a thread from the start, so a long message
+    is sent while they load.
+    Each step is retried on its own: after a flood wait (RetryAfter) and on network errors with a jittered
+    backoff. A request Telegram rejects (BadRequest) would be rejected again and is not retried; core.formatter
+    escapes the posts so that their markdown parses.
+    Delivered steps are never sent again. A step that timed out is not retried either, as Telegram may have
+    accepted the request and only its answer was lost: it is recorded as uncertain (None) in the progress
+    of the post and skipped when the post is resumed
+    """
+
+    def __init__(self, token: str, image_pipeline: Optional[ImagePipeline] = None, base_url: Optional[str] = None,
+                 max_retries: int = 5, pool_size: int = 16, timeout: float = 60):
+        request = HTTPXRequest(connection_pool_size=pool_size, read_timeout=timeout, write_timeout=timeout,
+                               media_write_timeout=timeout, connect_timeout=10, pool_timeout=timeout)
+        self.bot = telegram.Bot(token, base_url=base_url or "https://api.telegram.org/bot", request=request)
+        self.image_pipeline = image_pipeline
+        self.max_retries = max_retries
+        self.retries = 0
+        self.flood_waits = 0
+        self.messages_sent = 0
+
+    async def __aenter__(self) -> "Delivery":
+        await self.bot.initialize()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.bot.shutdown()
+
+    def stats(self) -> dict:
+        return {"messages_sent": self.messages_sent, "retries": self.retries, "flood_waits": self.flood_waits}
+
+    def prepare_photos(self, post: dict) -> asyncio.Future:
+        """
+        Photos of the post from the image pipeline, unavailable ones skipped; without a pipeline Telegram
+        fetches them by URL
+        """
+        if self.image_pipeline is None:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(post["images"])
+            return future
+        return asyncio.ensure_future(asyncio.to_thread(self.image_pipeline.get_many, post["images"], "telegram"))
+
+    async def deliver(self, post: dict, chat_id: str, sent: Optional[Dict[str, Optional[List[int]]]] = None,
+                      photos: Optional[asyncio.Future] = None) -> List[int]:
+        """
+        Sends the steps of the post that are not in `sent` yet and returns the ids of all its known messages.
+        Raises DeliveryError with the progress when a step fails
+        """
+        sent = {} if sent is None else sent
+        own_photos = photos is None
+        photos = self.prepare_photos(post) if own_photos else photos
+        long_message = len(post["message"]) >= MAX_CAPTION_LENGTH
+        steps = ["message", "media", "review"] if long_message else ["message", "review"]
+        try:
+            for step in steps:
+                if step in sent or step == "review" and not post["review"]:
+                    continue
+                images = [] if step == "review" or step == "message" and long_message else await photos
+                if step == "media" and not images:
+                    continue
+                try:
+                    messages = await self.send_step(step, post, images, chat_id)
+                except Exception as e:
+                    if isinstance(e, TimedOut):
+                        sent[step] = None
+                    raise DeliveryError(chat_id, step, sent, e) from e
+                sent[step] = [message.message_id for message in messages]
+                self.messages_sent += len(messages)
+                metrics.count("telegram_messages", len(messages), step=step)
+        finally:
+            if own_photos and not photos.done():
+                photos.cancel()
+        return [message_id for step in steps for message_id in sent.get(step) or []]
+
+    async def fan_out(
+        self, post: dict, chat_ids: Iterable[str], sent: Optional[Dict[str, Dict[str, Optional[List[int]]]]] = None
+    ) -> Dict[str, Union[List[int], Exception]]:
+        """
+        Delivers the same post to several channels concurrently, the photos are prepared once.
+        Returns the message ids or the DeliveryError of every channel
+        """
+        sent = {} if sent is None else sent
+        chat_ids = list(chat_ids)
+        photos = self.prepare_photos(post)
+        try:
+            results = await asyncio.gather(
+                *(self.deliver(post, chat_id, sent.setdefault(chat_id, {}), photos) for chat_id in chat_ids),
+                return_exceptions=True,
+            )
+        finally:
+            if not photos.done():
+                photos.cancel()
+        return dict(zip(chat_ids, results))
+
+    async def send_step(self, step: str, post: dict, images: list, chat_id: str) -> list:
+        attempt = 0
+        while True:
+            try:
+                with metrics.span("telegram", step=step, chat_id=chat_id, attempt=attempt):
+                    messages = await self.request(step, post, images, chat_id)
+                return messages if isinstance(messages, (list, tuple)) else [messages]
+            except RetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                self.flood_waits += 1
+                metrics.count("telegram_flood_wait_seconds", seconds(e.retry_after), step=step)
+                await asyncio.sleep(seconds(e.retry_after))
+            except BadRequest:
+                # BadRequest is a NetworkError, but a repeated request would fail the same way
+                raise
+            except TimedOut:
+                # TimedOut is a NetworkError, but resending could post the step twice
+                raise
+            except NetworkError as e:
+                if attempt >= self.max_retries:
+                    raise
+                self.retries += 1
+                metrics.count("telegram_retries", step=step, error=type(e).__name__)
+                await asyncio.sleep(min(2 ** attempt, 30) * (0.5 + random.random() / 2))
+            attempt += 1
+
+    def request(self, step: str, post: dict, images: list, chat_id: str):
+        if step == "media":
+            media = [telegram.InputMediaPhoto(image) for image in images]
+            return self.bot.send_media_group(chat_id=chat_id, media=media, caption=post["caption"],
+                                             parse_mode="markdown")
+        if step == "review":
+            return self.bot.send_message(chat_id=chat_id, text=post["review"], parse_mode="markdown")
+        if images:
+            return self.bot.send_photo(chat_id=chat_id, photo=images[0], caption=post["message"],
+                                       parse_mode="markdown")
+        return self.bot.send_message(chat_id=chat_id, text=post["message"], parse_mode="markdown")
+
+
+def seconds(period: Union[int, float, timedelta]) -> float:
+    return period.total_seconds() if isinstance(period, timedelta) else float(period)
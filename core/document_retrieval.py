@@ -1,84 +1,712 @@
+import hashlib
 import json
-from typing import List
+import os
+import itertools
+import pickle
+import shutil
+from typing import Collection, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple, Union
 
-import torch.cuda
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.base import AddableMixin, Docstore
 from langchain_core.document_loaders import BaseLoader
 from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from core.corpus import CorpusStore, file_hash, open_corpus
+from core.instrumentation import metrics
 
 
 class JSONDocumentLoader(BaseLoader):
     def __init__(self, file_path: str) -> None:
         self.file_path = file_path
 
-    def load(self) -> List[Document]:
-        with open(self.file_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+    def read(self) -> Mapping[str, dict]:
+        """
+        The parsed JSON, or a CorpusStore that parses records on access for .sqlite sources
+        """
+        return open_corpus(self.file_path)
+
+    def load(self, keys: Optional[Iterable[str]] = None) -> List[Document]:
+        data = self.read()
+        if keys is None:
+            keys = data.keys()
+        return [self.to_document(key, data[key]) for key in keys]
+
+    def lazy_load(self) -> Iterator[Document]:
+        for key, record in self.read().items():
+            yield self.to_document(key, record)
+
+    @staticmethod
+    def to_document(key: str, record: dict) -> Document:
+        metadata = dict(record)
+        metadata["key"] = key
+        content = metadata.pop("description_ru", "")
+        return Document(page_content=content, metadata=metadata)
+
+    @staticmethod
+    def record_hash(record: dict) -> str:
+        serialized = json.dumps(record, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
 
-        dataset = []
-        for key in data:
-            metadata = data[key]
-            metadata["key"] = key
-            content = metadata.pop("description_ru", "")
-            dataset.append(Document(page_content=content, metadata=metadata))
-        return dataset
+class CorpusDocstore(Docstore, AddableMixin):
+    """
+    Docstore of a VectorDB that keeps no documents: a chunk is found by its id "<record key>:<chunk number>"
+    in the corpus of the VectorDB (see VectorDB.chunk), so only the ids are held per vector.
+    Adding and deleting chunks have nothing to store
+    """
+
+    def __init__(self, vector_db: "VectorDB"):
+        self.vector_db = vector_db
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        pass
+
+    def delete(self, ids: List) -> None:
+        pass
+
+    def search(self, search: str) -> Union[str, Document]:
+        document = self.vector_db.chunk(search)
+        # as InMemoryDocstore answers a missing id
+        return document if document is not None else f"ID {search} not found."
 
 
 class VectorDB:
+    """
+    FAISS index over the corpus. Chunks are not stored: the index maps its vectors to chunk ids and
+    documents are read from the corpus (see CorpusDocstore), a .sqlite CorpusStore source keeps them on disk.
+    When cache_dir is set, the built index and chunk ids are stored
+    in a directory keyed by the source path, model and chunk settings. The cache is reused as is
+    while the content hash of the source file is unchanged; otherwise only the records whose
+    content hash changed are re-embedded (see update).
+
+    index_type selects the FAISS index: "flat" (exact), "sq8" (8-bit scalar quantization, 4x smaller)
+    or "ivfpq" (inverted lists with product quantization, trained on the corpus, searched with nprobe
+    lists). metric is "l2" or "cosine" (inner product over normalised vectors).
+
+    With workers > 1 the chunks are embedded on CPU by that many processes (see ParallelEmbeddings),
+    the index is the same as with one process. The processes run until close, or the end of a with block.
+    """
+
+    # caches of another format are in another directory and rebuilt
+    FORMAT = 2
+
     def __init__(
         self,
         file_path: str,
         model_path: str = "cointegrated/rubert-tiny2",
         chunk_size=2000,
         chunk_overlap=150,
+        cache_dir: Optional[str] = ".cache/vector_db",
+        index_type="flat",
+        metric="l2",
+        nprobe=8,
+        workers=1,
     ):
         self.file_path = file_path
         self.model_path = model_path
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        self.cache_dir = cache_dir
+        self.index_type = index_type
+        self.metric = metric
+        self.nprobe = nprobe
+        self.workers = workers
         self.docs = []
+        # the source records, read on first use by corpus()
+        self.data = None
+        # record key -> [record content hash, number of chunks in the index]
+        self.records = {}
         self.embeddings = None
         self.db = None
+        # record key and metadata (core.metadata.MetadataIndex, built by the first filtered search)
+        # of every vector, by its position in the index
+        self.position_keys = None
+        self.metadata = None
 
     def load(self, splitter=RecursiveCharacterTextSplitter):
         loader = JSONDocumentLoader(self.file_path)
-        self.docs = loader.load()
+        self.records = {}
+        docs = []
+        self.data = loader.read()
+        for key, record in self.data.items():
+            self.records[key] = [loader.record_hash(record), 0]
+            docs.append(loader.to_document(key, record))
+        self.docs = self.split(docs, splitter)
+
+    def split(self, docs, splitter=RecursiveCharacterTextSplitter):
         if splitter:
             text_splitter = splitter(
                 chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap
             )
-            self.docs = text_splitter.split_documents(self.docs)
+            docs = text_splitter.split_documents(docs)
+        return docs
+
+    def chunk_ids(self, docs) -> List[str]:
+        """
+        Assigns stable ids "<record key>:<chunk number>" to the chunks and counts them in self.records
+        """
+        ids = []
+        counts = {}
+        for doc in docs:
+            key = doc.metadata["key"]
+            ids.append(f"{key}:{counts.get(key, 0)}")
+            counts[key] = counts.get(key, 0) + 1
+        for key, count in counts.items():
+            self.records[key][1] = count
+        return ids
 
     def init_embeddings(self):
+        if self.workers > 1:
+            from core.parallel_embeddings import ParallelEmbeddings
+
+            self.embeddings = ParallelEmbeddings(self.model_path, self.workers)
+            return
+
+        import torch.cuda
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+
         if torch.cuda.is_available():
             model_kwargs = {"device": "cuda:0"}
         else:
             model_kwargs = {"device": "cpu"}
         encode_kwargs = {"normalize_embeddings": False}
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name=self.model_path,
-            model_kwargs=model_kwargs,
-            encode_kwargs=encode_kwargs,
-        )
+        with metrics.span("model_load", model=self.model_path, device=model_kwargs["device"]):
+            self.embeddings = HuggingFaceEmbeddings(
+                model_name=self.model_path,
+                model_kwargs=model_kwargs,
+                encode_kwargs=encode_kwargs,
+            )
+
+    def close(self):
+        """
+        Stops the embedding processes; the index can still be searched, and embedding starts them again
+        """
+        from core.parallel_embeddings import ParallelEmbeddings
+
+        if isinstance(self.embeddings, ParallelEmbeddings):
+            self.embeddings.close()
+
+    def __enter__(self) -> "VectorDB":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
     def create_db(self):
         if not self.embeddings:
             self.init_embeddings()
-        self.db = FAISS.from_documents(self.docs, self.embeddings)
+        if self.cache_dir:
+            meta = self.read_cache_meta()
+            if meta and meta["source_hash"] == self.source_hash():
+                self.load_cache()
+                return
+            if meta:
+                self.update()
+                return
+        if self.docs:
+            self.build()
+        else:
+            self.build_streaming()
+        if self.cache_dir:
+            self.save_cache()
+
+    def build(self):
+        if not self.docs:
+            self.load()
+        self.db = None
+        self.add_batch(self.docs)
+
+    def build_streaming(self, batch_size=256, checkpoint_every=10000, train_size=10000):
+        """
+        Builds the index record by record: records are split as they are read and embedded in batches of
+        about batch_size chunks, so besides the index and the chunk ids only one batch is held in memory
+        (with a CorpusStore source, the records are not held either). Every checkpoint_every chunks
+        the partial index is saved to the cache directory, and an interrupted build resumes after the last
+        saved record. Index types that need training are trained on the first train_size chunks
+        """
+        loader = JSONDocumentLoader(self.file_path)
+        data = self.data = loader.read()
+        self.db = None
+        self.records = {}
+        done = 0
+        if self.cache_dir:
+            done = self.load_checkpoint()
+        if isinstance(data, CorpusStore):
+            records = data.items(start=done)
+        else:
+            records = itertools.islice(data.items(), done, None)
+
+        first_batch_size = batch_size if self.index_type == "flat" else train_size
+        batch = []
+        since_checkpoint = 0
+        for key, record in records:
+            self.records[key] = [loader.record_hash(record), 0]
+            batch.extend(self.split([loader.to_document(key, record)]))
+            done += 1
+            if len(batch) < (first_batch_size if self.db is None else batch_size):
+                continue
+            self.add_batch(batch)
+            since_checkpoint += len(batch)
+            batch = []
+            if self.cache_dir and since_checkpoint >= checkpoint_every:
+                self.save_checkpoint(done)
+                since_checkpoint = 0
+        if batch:
+            self.add_batch(batch)
+        if self.cache_dir:
+            shutil.rmtree(os.path.join(self.cache_path(), "partial"), ignore_errors=True)
+
+    def add_batch(self, docs):
+        """
+        Embeds docs and adds them to the index, creating the index from this batch if there is none
+        """
+        ids = self.chunk_ids(docs)
+        texts = [doc.page_content for doc in docs]
+        with metrics.span("embed", chunks=len(texts)):
+            vectors = self.embeddings.embed_documents(texts)
+        if self.db is None:
+            self.db = self.new_store(self.new_index(vectors), {})
+        self.db.add_embeddings(
+            zip(texts, vectors), [doc.metadata for doc in docs], ids=ids
+        )
+        self.position_keys = None
+
+    def new_index(self, vectors):
+        """
+        Creates an empty index of self.index_type, trained on vectors if the index type needs it
+        """
+        import faiss
+        import numpy as np
+
+        vectors = np.array(vectors, dtype=np.float32)
+        n, dim = vectors.shape
+        if self.metric == "cosine":
+            faiss.normalize_L2(vectors)
+            metric = faiss.METRIC_INNER_PRODUCT
+        elif self.metric == "l2":
+            metric = faiss.METRIC_L2
+        else:
+            raise ValueError(f"Unknown metric: {self.metric}")
+
+        if self.index_type == "flat":
+            description = "Flat"
+        elif self.index_type == "sq8":
+            description = "SQ8"
+        elif self.index_type == "ivfpq":
+            nlist = max(1, min(int(4 * n ** 0.5), n // 39))
+            # sub-vectors of 8 dimensions or the closest size dividing dim, 16 centroids on small corpora
+            pq_m = max(m for m in range(1, dim // 8 + 1) if dim % m == 0)
+            nbits = 8 if n >= 256 * 39 else 4
+            # np: without the polysemous training index_factory does by default, unused by the search and slow
+            description = f"IVF{nlist},PQ{pq_m}x{nbits}np"
+        else:
+            raise ValueError(f"Unknown index type: {self.index_type}")
+
+        index = faiss.index_factory(dim, description, metric)
+        if not index.is_trained:
+            with metrics.span("index_train", index=description, vectors=n):
+                index.train(vectors)
+        self.set_search_params(index)
+        return index
+
+    def set_search_params(self, index):
+        import faiss
+
+        ivf = faiss.try_extract_index_ivf(index)
+        if ivf is not None:
+            ivf.nprobe = self.nprobe
+
+    def new_store(self, index, index_to_docstore_id):
+        from langchain_community.vectorstores import FAISS
+        from langchain_community.vectorstores.utils import DistanceStrategy
+
+        if self.metric == "cosine":
+            distance_strategy = DistanceStrategy.MAX_INNER_PRODUCT
+        else:
+            distance_strategy = DistanceStrategy.EUCLIDEAN_DISTANCE
+        return FAISS(
+            self.embeddings,
+            index,
+            CorpusDocstore(self),
+            index_to_docstore_id,
+            normalize_L2=self.metric == "cosine",
+            distance_strategy=distance_strategy,
+        )
+
+    def update(self, batch_size=256):
+        """
+        Brings the cached index in line with the source file: chunks of deleted and changed records
+        are removed from the index, new and changed records are embedded and added
+        """
+        if not self.embeddings:
+            self.init_embeddings()
+        if not (self.cache_dir and self.load_cache()):
+            self.build()
+            if self.cache_dir:
+                self.save_cache()
+            return
+
+        loader = JSONDocumentLoader(self.file_path)
+        data = self.data = loader.read()
+        hashes = {key: loader.record_hash(record) for key, record in data.items()}
+        stale = [
+            key for key, (record_hash, _) in self.records.items()
+            if hashes.get(key) != record_hash
+        ]
+        fresh = [
+            key for key, record_hash in hashes.items()
+            if key not in self.records or self.records[key][0] != record_hash
+        ]
+
+        stale_ids = [
+            f"{key}:{i}" for key in stale for i in range(self.records[key][1])
+        ]
+        if stale_ids:
+            self.db.delete(stale_ids)
+            self.position_keys = None
+        for key in stale:
+            del self.records[key]
+
+        batch = []
+        for key in fresh:
+            self.records[key] = [hashes[key], 0]
+            batch.extend(self.split([loader.to_document(key, data[key])]))
+            if len(batch) >= batch_size:
+                self.add_batch(batch)
+                batch = []
+        if batch:
+            self.add_batch(batch)
+        self.save_cache()
 
     def get_retriever(self):
         if not self.db:
             self.create_db()
         return self.db.as_retriever()
 
+    def document(self, position: int) -> Document:
+        return self.chunk(self.db.index_to_docstore_id[position])
+
+    def chunk(self, chunk_id: str) -> Optional[Document]:
+        """
+        The chunk "<record key>:<chunk number>" split again from its record, None if there is no such chunk
+        """
+        key, _, number = chunk_id.rpartition(":")
+        corpus = self.corpus()
+        if key not in corpus:
+            return None
+        document = JSONDocumentLoader.to_document(key, corpus[key])
+        if len(document.page_content) <= self.chunk_size:
+            # the splitter keeps a short text whole, only stripped, and drops it when it is blank
+            document.page_content = document.page_content.strip()
+            chunks = [document] if document.page_content else []
+        else:
+            chunks = self.split([document])
+        return chunks[int(number)] if int(number) < len(chunks) else None
+
+    def corpus(self) -> Mapping[str, dict]:
+        if self.data is None:
+            self.data = JSONDocumentLoader(self.file_path).read()
+        return self.data
+
+    def record_document(self, key: str) -> Document:
+        """
+        The whole record, for records found by other means than a vector search, which may have no chunks
+        in the index (an empty description). Raises KeyError for keys missing from the corpus
+        """
+        return JSONDocumentLoader.to_document(key, self.corpus()[key])
+
+    def index_positions(self):
+        ids = self.db.index_to_docstore_id
+        self.position_keys = [ids[i].rpartition(":")[0] for i in range(self.db.index.ntotal)]
+        self.metadata = None
+
+    def metadata_index(self):
+        """
+        The MetadataIndex of the vectors. Building it reads every record of the corpus, so unfiltered
+        searches never do
+        """
+        from core.metadata import MetadataIndex
+
+        if self.position_keys is None:
+            self.index_positions()
+        if self.metadata is None:
+            self.metadata = MetadataIndex.from_records(self.position_records())
+        return self.metadata
+
+    def position_records(self) -> Iterator[dict]:
+        """
+        The record of every vector, by position. The chunks of a record are added together,
+        so every record is read once
+        """
+        corpus = self.corpus()
+        for key, positions in itertools.groupby(self.position_keys):
+            record = corpus[key]
+            for _ in positions:
+                yield record
+
+    def search_records(
+        self,
+        vectors,
+        k: int,
+        exclude: Optional[Sequence[Collection[str]]] = None,
+        fetch_k=16,
+        aggregation="max",
+        where: Optional[Mapping] = None,
+    ) -> List[List[Tuple[str, float, int]]]:
+        """
+        Finds k distinct records nearest to each query vector with a single index.search over all
+        of them. Returns (record key, aggregated score, position of the best chunk) lists, higher
+        score is better. Queries that gather fewer than k records among fetch_k chunks are searched
+        again with twice as many chunks.
+        With a metadata filter (see MetadataIndex.mask), e.g. {"category": "Hybrid Art", "year": (None, 1999)},
+        FAISS only scores the chunks in its bitmap, so k records are returned whenever k records match.
+        An IVF index that is still short after fetching every matching chunk probes all of its lists
+        """
+        import faiss
+        import numpy as np
+
+        if self.position_keys is None:
+            self.index_positions()
+        vectors = np.array(vectors, dtype=np.float32)
+        if self.metric == "cosine":
+            faiss.normalize_L2(vectors)
+        if exclude is None:
+            exclude = [()] * len(vectors)
+        ntotal = self.db.index.ntotal
+        higher_is_better = self.db.index.metric_type == faiss.METRIC_INNER_PRODUCT
+
+        params, ivf, limit = None, None, ntotal
+        mask = self.metadata_index().mask(where) if where else None
+        if mask is not None:
+            limit = int(mask.sum())
+            if limit == 0:
+                return [[] for _ in range(len(vectors))]
+            # the selector reads the bitmap in place, it has to live until the last search
+            bitmap = np.packbits(mask, bitorder="little")
+            selector = faiss.IDSelectorBitmap(ntotal, faiss.swig_ptr(bitmap))
+            ivf = faiss.try_extract_index_ivf(self.db.index)
+            if ivf is not None:
+                params = faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+            else:
+                params = faiss.SearchParameters(sel=selector)
+
+        results = [[] for _ in range(len(vectors))]
+        pending = np.arange(len(vectors))
+        while len(pending):
+            fetch_k = min(fetch_k, limit)
+            distances, positions = self.db.index.search(vectors[pending], fetch_k, params=params)
+            scores = distances if higher_is_better else -distances
+            widen = ivf is not None and fetch_k == limit and params.nprobe < ivf.nlist
+            short = []
+            for query_ind, row_scores, row_positions in zip(pending, scores, positions):
+                records = aggregate_records(
+                    row_scores, row_positions, self.position_keys,
+                    exclude[query_ind], aggregation,
+                )
+                results[query_ind] = records[:k]
+                if len(records) < k and (fetch_k < limit or widen):
+                    short.append(query_ind)
+            pending = np.array(short, dtype=np.int64)
+            fetch_k *= 2
+            if widen:
+                params.nprobe = ivf.nlist
+        return results
+
+    def source_hash(self) -> str:
+        return file_hash(self.file_path)
+
+    def config_key(self) -> str:
+        config = [
+            self.FORMAT,
+            os.path.abspath(self.file_path),
+            self.model_path,
+            self.chunk_size,
+            self.chunk_overlap,
+            self.index_type,
+            self.metric,
+        ]
+        return hashlib.sha256(json.dumps(config).encode("utf-8")).hexdigest()[:16]
+
+    def cache_path(self) -> str:
+        return os.path.join(self.cache_dir, self.config_key())
+
+    def read_cache_meta(self) -> Optional[dict]:
+        meta_path = os.path.join(self.cache_path(), "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def load_cache(self) -> bool:
+        """
+        Loads the cached index whatever the source hash is, returns False if there is no cache
+        """
+        if not self.read_cache_meta():
+            return False
+        self.read_index(self.cache_path())
+        return True
+
+    def save_cache(self):
+        path = self.cache_path()
+        # meta.json is written last, so a half-written cache is never considered valid
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        self.write_index(path)
+
+        meta = {
+            "source_hash": self.source_hash(),
+            "model_path": self.model_path,
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            "index_type": self.index_type,
+            "metric": self.metric,
+        }
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def write_index(self, path):
+        import faiss
+
+        os.makedirs(path, exist_ok=True)
+        index_path = os.path.join(path, "index.faiss")
+        faiss.write_index(self.db.index, index_path + ".tmp")
+        os.replace(index_path + ".tmp", index_path)
+
+        ids_path = os.path.join(path, "ids.pkl")
+        with open(ids_path + ".tmp", "wb") as f:
+            pickle.dump((self.db.index_to_docstore_id, self.records), f)
+        os.replace(ids_path + ".tmp", ids_path)
+
+    def read_index(self, path):
+        import faiss
+
+        # the whole index is read into memory: faiss can only map the inverted lists of IVF indexes
+        # stored on disk, and the flat and SQ8 codes have to be searched in RAM anyway
+        with metrics.span("index_load"):
+            index = faiss.read_index(os.path.join(path, "index.faiss"))
+            self.set_search_params(index)
+            with open(os.path.join(path, "ids.pkl"), "rb") as f:
+                index_to_docstore_id, self.records = pickle.load(f)
+        self.db = self.new_store(index, index_to_docstore_id)
+        self.position_keys = None
+
+    def save_checkpoint(self, records_done: int):
+        path = os.path.join(self.cache_path(), "partial")
+        progress_path = os.path.join(path, "progress.json")
+        if os.path.exists(progress_path):
+            os.remove(progress_path)
+        self.write_index(path)
+        with open(progress_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"source_hash": self.source_hash(), "records_done": records_done}, f)
+        os.replace(progress_path + ".tmp", progress_path)
+
+    def load_checkpoint(self) -> int:
+        """
+        Restores the partial index of an interrupted build of the same source,
+        returns the number of records it covers
+        """
+        path = os.path.join(self.cache_path(), "partial")
+        progress_path = os.path.join(path, "progress.json")
+        if not os.path.exists(progress_path):
+            return 0
+        with open(progress_path, "r", encoding="utf-8") as f:
+            progress = json.load(f)
+        if progress["source_hash"] != self.source_hash():
+            return 0
+        self.read_index(path)
+        return progress["records_done"]
+
+
+def aggregate_records(
+    scores, positions, position_keys: List[str], exclude: Collection[str] = (), aggregation="max"
+) -> List[Tuple[str, float, int]]:
+    """
+    Groups chunk hits of one query by record key, aggregating their scores with max or mean.
+    Returns (record key, score, position of the best chunk) sorted by score
+    """
+    records = {}
+    for score, position in zip(scores, positions):
+        if position < 0:
+            continue
+        key = position_keys[position]
+        if key in exclude:
+            continue
+        if key in records:
+            records[key][0].append(float(score))
+        else:
+            records[key] = ([float(score)], int(position))
+
+    aggregated = []
+    for key, (record_scores, position) in records.items():
+        if aggregation == "max":
+            score = max(record_scores)
+        elif aggregation == "mean":
+            score = sum(record_scores) / len(record_scores)
+        else:
+            raise ValueError(f"Unknown aggregation: {aggregation}")
+        aggregated.append((key, score, position))
+    aggregated.sort(key=lambda record: -record[1])
+    return aggregated
+
 
 class Retriever:
-    def __init__(self, vector_db: VectorDB):
+    """
+    query_ind is the key of the query record, which is left out of the results in every mode.
+    In "records" mode chunk hits are grouped by record, so k distinct artworks other than the query one
+    are always returned. "hybrid" mode fuses these records with the BM25 ranking of a lexical index
+    (core.lexical.BM25Index) by reciprocal rank, so records sharing authors, names or categories with
+    the query one are found too.
+    "chunks" mode is the plain LangChain retriever, kept for comparison
+    """
+
+    def __init__(self, vector_db: VectorDB, mode="records", aggregation="max", fetch_k=16, lexical=None,
+                 candidates=20, rrf_k=60):
+        if mode == "hybrid" and lexical is None:
+            raise ValueError("Hybrid mode needs a lexical index")
+        self.vector_db = vector_db
         self.retriever = vector_db.get_retriever()
+        self.mode = mode
+        self.aggregation = aggregation
+        self.fetch_k = fetch_k
+        self.lexical = lexical
+        self.candidates = candidates
+        self.rrf_k = rrf_k
 
-    def get_top_k(self, query, query_ind="", k=3):
-        docs = self.retriever.get_relevant_documents(query)
-        docs = [doc for doc in docs if doc.metadata["name"] != query_ind][:k]
-        return docs
+    def get_top_k(self, query, query_ind="", k=3, where=None):
+        """
+        where is a metadata filter of the records, e.g. {"category": "Hybrid Art", "year": (None, 1999)},
+        see VectorDB.search_records
+        """
+        if self.mode == "chunks":
+            if where:
+                raise ValueError("Metadata filters need records or hybrid mode")
+            docs = self.retriever.get_relevant_documents(query)
+            docs = [doc for doc in docs if doc.metadata["key"] != query_ind][:k]
+            return docs
+        vector = self.vector_db.embeddings.embed_query(query)
+        if self.mode != "hybrid":
+            records = self.vector_db.search_records(
+                [vector], k, [{query_ind}], self.fetch_k, self.aggregation, where
+            )[0]
+            return [self.vector_db.document(position) for _, _, position in records]
+
+        from core.lexical import reciprocal_rank_fusion
+
+        candidates = max(k, self.candidates)
+        records = self.vector_db.search_records(
+            [vector], candidates, [{query_ind}], self.fetch_k, self.aggregation, where
+        )[0]
+        if query_ind in self.lexical:
+            lexical = self.lexical.search_record(query_ind, candidates, where=where)
+        else:
+            lexical = self.lexical.search(query, candidates, {query_ind}, where)
+        keys = reciprocal_rank_fusion(
+            [[key for key, _, _ in records], [key for key, _ in lexical]], self.rrf_k
+        )[:k]
+        positions = {key: position for key, _, position in records}
+        return [
+            self.vector_db.document(positions[key]) if key in positions else self.vector_db.record_document(key)
+            for key in keys
+        ]
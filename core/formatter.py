@@ -0,0 +1,130 @@
+"""
+Post texts in Telegram's legacy markdown. Fields are escaped while formatting, so Telegram never rejects
+a post for its markdown, and the description is cut to the length left by the other fields, so every
+message is formatted once
+"""
+import re
+from functools import lru_cache
+from typing import Callable
+
+MAX_POST_LENGTH = 4096
+MAX_CAPTION_LENGTH = 1024
+ELLIPSIS = "..."
+REVIEW_SIGNATURE = "\n\n_Рецензия GPT-4_"
+
+MARKDOWN_SPLIT = re.compile(r"([_*`\[])")
+# **bold**, *italic* and _italic_ in the markdown of the model's reviews; an underscore inside a word
+# and a star between spaces (2 * 3) are not markup
+REVIEW_MARKUP = re.compile(
+    r"\*\*(?P<bold>[^*\s](?:[^*\n]*[^*\s])?)\*\*"
+    r"|\*(?P<star>[^*\s](?:[^*\n]*[^*\s])?)\*"
+    r"|(?<!\w)_(?P<underscore>[^_\s](?:[^_\n]*[^_\s])?)_(?!\w)"
+)
+# dashes, brackets and & are dropped, slashes and underscores separate words
+HASHTAG_TABLE = str.maketrans({"-": None, "–": None, "(": None, ")": None, "&": None, "/": " ", "_": " ",
+                               "*": None, "`": None, "[": None, "]": None})
+
+MESSAGE_HEAD = "{name}\n\n{authors}\n\n{award}\n{category}\n\n"
+MESSAGE_TAIL = "\n\n{url}\n\n{hashtags}"
+CAPTION = "{name}\n\n{authors}\n\n{url}\n\n{hashtags}"
+
+
+def escape(text: str) -> str:
+    # on Cyrillic text str.translate takes its slow path, four replaces are about 10 times faster
+    return text.replace("_", "\\_").replace("*", "\\*").replace("`", "\\`").replace("[", "\\[")
+
+
+def entity(text: str, marker: str) -> str:
+    """
+    Text in a bold (*) or italic (_) entity. Legacy markdown can not escape inside an entity,
+    so the entity is closed around every escaped character
+    """
+    return "".join(
+        "\\" + part if MARKDOWN_SPLIT.fullmatch(part) else f"{marker}{part}{marker}"
+        for part in MARKDOWN_SPLIT.split(text) if part
+    )
+
+
+@lru_cache(maxsize=None)
+def hashtag(text: str) -> str:
+    """
+    '#' followed by the lowercase words joined with escaped underscores. Awards, categories and years repeat
+    across the corpus, so the tags are cached
+    """
+    return "#" + "\\_".join(text.lower().translate(HASHTAG_TABLE).split())
+
+
+def hashtags(artwork: dict) -> str:
+    return f'{hashtag(artwork["award"])} {hashtag(artwork["category"])} {hashtag(str(artwork["year"]))}year'
+
+
+def fit(text: str, budget: int, escape_text: Callable[[str], str] = escape) -> str:
+    """
+    Escaped text of at most `budget` characters. A longer text is cut with an ellipsis before escaping,
+    so no escape is split, at the longest prefix that fits
+    """
+    # escaping never shortens a text, so a text longer than the budget is cut and only its prefix is escaped
+    if len(text) <= budget:
+        escaped = escape_text(text)
+        if len(escaped) <= budget:
+            return escaped
+    if escape_text is escape:
+        # an escape is a backslash before the character, so the escaped prefix is cut directly
+        escaped = escape(text[:budget])[:budget - len(ELLIPSIS)]
+        return (escaped[:-1] if escaped.endswith("\\") else escaped) + ELLIPSIS
+    low, high = 0, min(len(text), budget)
+    while high - low > 1:
+        middle = (low + high) // 2
+        if len(escape_text(text[:middle] + ELLIPSIS)) <= budget:
+            low = middle
+        else:
+            high = middle
+    return escape_text(text[:low] + ELLIPSIS)
+
+
+def message_text(artwork: dict) -> str:
+    head = MESSAGE_HEAD.format(
+        name=entity(artwork["name"], "*"),
+        authors=escape(artwork["authors"]),
+        award=entity(f'{artwork["award"]}, {artwork["year"]}', "_"),
+        category=entity(artwork["category"], "_"),
+    )
+    tail = MESSAGE_TAIL.format(url=escape(artwork["url"]), hashtags=hashtags(artwork))
+    return head + fit(artwork["description_ru"], MAX_POST_LENGTH - len(head) - len(tail)) + tail
+
+
+def caption_text(artwork: dict) -> str:
+    """
+    Caption of the photos sent after a long message, long author lists are cut to fit MAX_CAPTION_LENGTH
+    """
+    name = entity(artwork["name"], "*")
+    url = escape(artwork["url"])
+    tags = hashtags(artwork)
+    budget = MAX_CAPTION_LENGTH - len(CAPTION.format(name=name, authors="", url=url, hashtags=tags))
+    year = artwork["year"]
+    authors = fit(artwork["authors"], budget, lambda text: entity(f"{text} ({year})", "_"))
+    return CAPTION.format(name=name, authors=authors, url=url, hashtags=tags)
+
+
+def review_markdown(review: str) -> str:
+    """
+    The review with the bold and italic of the model's markdown turned into entities and the rest escaped
+    """
+    parts = []
+    end = 0
+    for match in REVIEW_MARKUP.finditer(review):
+        parts.append(escape(review[end:match.start()]))
+        bold, star, underscore = match.groups()
+        parts.append(entity(bold, "*") if bold is not None else entity(star or underscore, "_"))
+        end = match.end()
+    parts.append(escape(review[end:]))
+    return "".join(parts)
+
+
+def review_text(review: str) -> str:
+    budget = MAX_POST_LENGTH - len(REVIEW_SIGNATURE)
+    # the entities are shorter than the model's **markup**, a review a bit over the budget may still fit
+    text = review_markdown(review)
+    if len(text) > budget:
+        text = fit(review, budget, review_markdown)
+    return text + REVIEW_SIGNATURE
@@ -0,0 +1,145 @@
+import base64
+import hashlib
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from core.instrumentation import metrics
+
+
+class ImagePipeline:
+    """
+    Fetches artwork images concurrently over one pooled session and stores them on disk by content
+    hash, so an image shared by several records or requested again is downloaded once. Each original
+    is resized on demand into the variants below (longest side in pixels), stored as JPEG.
+    A URL that cannot be fetched within the timeout is reported as missing instead of stalling the post
+    """
+
+    VARIANTS = {
+        "thumb": 256,
+        "model": 512,
+        "telegram": 1280,
+    }
+
+    def __init__(self, cache_dir=".cache/images", max_workers=8, timeout=(5, 20), retries=2):
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=max_workers,
+            pool_maxsize=max_workers,
+            max_retries=Retry(total=retries, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504)),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.bytes_fetched = 0
+        self.lock = threading.Lock()
+        os.makedirs(os.path.join(cache_dir, "urls"), exist_ok=True)
+        os.makedirs(os.path.join(cache_dir, "original"), exist_ok=True)
+        for variant in self.VARIANTS:
+            os.makedirs(os.path.join(cache_dir, variant), exist_ok=True)
+
+    def fetch(self, urls: Iterable[str]) -> Dict[str, Optional[str]]:
+        """
+        Makes sure the images are on disk, downloading the missing ones concurrently.
+        Returns url -> content hash, None for images that could not be fetched
+        """
+        urls = list(dict.fromkeys(urls))
+        hashes = {url: self.content_hash(url) for url in urls}
+        missing = [url for url, content_hash in hashes.items() if content_hash is None]
+        if missing:
+            with metrics.span("image_fetch", images=len(missing)), \
+                    ThreadPoolExecutor(max_workers=min(self.max_workers, len(missing))) as executor:
+                for url, content_hash in zip(missing, executor.map(self.download, missing)):
+                    hashes[url] = content_hash
+        return hashes
+
+    def download(self, url: str) -> Optional[str]:
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            print(f'Image {url} was not fetched: {e!r}')
+            metrics.count("image_fetch_errors", error=type(e).__name__)
+            return None
+        content = response.content
+        with self.lock:
+            self.bytes_fetched += len(content)
+        metrics.count("image_bytes", len(content))
+        content_hash = hashlib.sha256(content).hexdigest()
+        original_path = os.path.join(self.cache_dir, "original", content_hash)
+        if not os.path.exists(original_path):
+            write_atomic(original_path, content)
+        write_atomic(self.url_path(url), content_hash.encode("ascii"))
+        return content_hash
+
+    def url_path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, "urls", hashlib.sha256(url.encode("utf-8")).hexdigest())
+
+    def content_hash(self, url: str) -> Optional[str]:
+        path = self.url_path(url)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="ascii") as f:
+            return f.read().strip()
+
+    def path(self, url: str, variant="model") -> Optional[str]:
+        """
+        Path of the variant of an already fetched image, None if the image is not available
+        """
+        from PIL import Image
+
+        content_hash = self.content_hash(url)
+        if content_hash is None:
+            return None
+        path = os.path.join(self.cache_dir, variant, content_hash + ".jpg")
+        if os.path.exists(path):
+            return path
+        try:
+            with metrics.span("image_resize", variant=variant), \
+                    Image.open(os.path.join(self.cache_dir, "original", content_hash)) as image:
+                image = image.convert("RGB")
+                image.thumbnail((self.VARIANTS[variant], self.VARIANTS[variant]))
+                buffer = io.BytesIO()
+                image.save(buffer, format="JPEG", quality=85)
+        except OSError as e:
+            print(f'Image {url} could not be decoded: {e!r}')
+            return None
+        write_atomic(path, buffer.getvalue())
+        return path
+
+    def get_bytes(self, url: str, variant="model") -> Optional[bytes]:
+        path = self.path(url, variant)
+        if path is None:
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def get_data_url(self, url: str, variant="model") -> Optional[str]:
+        content = self.get_bytes(url, variant)
+        if content is None:
+            return None
+        return "data:image/jpeg;base64," + base64.b64encode(content).decode("ascii")
+
+    def get_many(self, urls: List[str], variant="model", as_data_url=False) -> list:
+        """
+        Fetches urls and returns the variants of the available images, keeping their order
+        """
+        self.fetch(urls)
+        getter = self.get_data_url if as_data_url else self.get_bytes
+        images = [getter(url, variant) for url in urls]
+        return [image for image in images if image is not None]
+
+
+def write_atomic(path: str, content: bytes):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
@@ -0,0 +1,131 @@
+import atexit
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from typing import Optional
+
+# key of the post being generated or delivered, set by Instrumentation.post and copied into asyncio tasks
+# and to_thread calls, so the events of concurrent posts are told apart
+current_post = contextvars.ContextVar("current_post", default=None)
+NO_SPAN = nullcontext()
+
+
+class Instrumentation:
+    """
+    Timing spans around the stages of a post and counters (OpenAI tokens and cost, image bytes, retries).
+    Every span and count is written as a JSON line to jsonl_path, with the key of the current post; totals
+    per stage and counter are written in the Prometheus text format to prometheus_path by flush, e.g. for
+    the node_exporter textfile collector. Until configure is called nothing is recorded and a span is
+    a shared no-op context
+    """
+
+    PREFIX = "science_art"
+
+    def __init__(self):
+        self.jsonl = None
+        self.prometheus_path = None
+        self.enabled = False
+        self.lock = threading.Lock()
+        # stage -> [count, seconds, errors]
+        self.spans = defaultdict(lambda: [0, 0.0, 0])
+        self.counters = defaultdict(float)
+
+    def configure(self, jsonl_path: Optional[str] = None, prometheus_path: Optional[str] = None):
+        if jsonl_path:
+            os.makedirs(os.path.dirname(jsonl_path) or ".", exist_ok=True)
+            self.jsonl = open(jsonl_path, "a", encoding="utf-8", buffering=1)
+        if prometheus_path:
+            if not self.prometheus_path:
+                atexit.register(self.flush)
+            self.prometheus_path = prometheus_path
+        self.enabled = bool(self.jsonl or self.prometheus_path)
+
+    @contextmanager
+    def post(self, key: str):
+        token = current_post.set(key)
+        try:
+            yield
+        finally:
+            current_post.reset(token)
+
+    def span(self, stage: str, **labels):
+        """
+        Times the block as `stage`; labels only go to the JSON line. A block left by an exception
+        counts as an error of the stage and is recorded with the exception type
+        """
+        if not self.enabled:
+            return NO_SPAN
+        return self.timed(stage, labels)
+
+    @contextmanager
+    def timed(self, stage: str, labels: dict):
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            with self.lock:
+                totals = self.spans[stage]
+                totals[0] += 1
+                totals[1] += seconds
+                totals[2] += error is not None
+            self.emit({"span": stage, "s": round(seconds, 6), **labels, **({"error": error} if error else {})})
+
+    def count(self, name: str, value: float = 1, **labels):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] += value
+        self.emit({"count": name, "value": value, **labels})
+
+    def emit(self, event: dict):
+        if self.jsonl is None:
+            return
+        line = json.dumps({"t": round(time.time(), 3), "post": current_post.get(), **event}, ensure_ascii=False)
+        with self.lock:
+            self.jsonl.write(line + "\n")
+
+    def summary(self) -> dict:
+        with self.lock:
+            return {
+                "stages": {
+                    stage: {"count": count, "seconds": round(seconds, 6), "errors": errors}
+                    for stage, (count, seconds, errors) in self.spans.items()
+                },
+                "counters": dict(self.counters),
+            }
+
+    def flush(self):
+        """
+        Rewrites the Prometheus text file with the totals since the start of the process
+        """
+        if not self.prometheus_path:
+            return
+        summary = self.summary()
+        lines = []
+        if summary["stages"]:
+            lines.append(f"# TYPE {self.PREFIX}_stage_seconds summary")
+            for stage, totals in summary["stages"].items():
+                lines.append(f'{self.PREFIX}_stage_seconds_count{{stage="{stage}"}} {totals["count"]}')
+                lines.append(f'{self.PREFIX}_stage_seconds_sum{{stage="{stage}"}} {totals["seconds"]}')
+            lines.append(f"# TYPE {self.PREFIX}_stage_errors_total counter")
+            for stage, totals in summary["stages"].items():
+                lines.append(f'{self.PREFIX}_stage_errors_total{{stage="{stage}"}} {totals["errors"]}')
+        for name, value in summary["counters"].items():
+            lines.append(f"# TYPE {self.PREFIX}_{name}_total counter")
+            lines.append(f"{self.PREFIX}_{name}_total {float(value)!r}")
+        os.makedirs(os.path.dirname(self.prometheus_path) or ".", exist_ok=True)
+        with open(self.prometheus_path + ".tmp", "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(self.prometheus_path + ".tmp", self.prometheus_path)
+
+
+metrics = Instrumentation()
@@ -0,0 +1,221 @@
+import hashlib
+import os
+import re
+from collections import Counter
+from typing import Collection, Dict, Iterable, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+from core.corpus import file_hash, open_corpus
+from core.metadata import MetadataIndex
+
+TOKEN = re.compile(r"\w+")
+STEM_LENGTH = 6
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercase words cut to their first STEM_LENGTH characters, a cheap stemmer for both the Russian
+    descriptions and the names, so that inflected forms share a term
+    """
+    return [token[:STEM_LENGTH] for token in TOKEN.findall(text.lower()) if len(token) > 1]
+
+
+def join_strings(strings: Iterable[str]) -> np.ndarray:
+    return np.frombuffer("\n".join(strings).encode("utf-8"), dtype=np.uint8)
+
+
+def split_strings(array: np.ndarray) -> List[str]:
+    return array.tobytes().decode("utf-8").split("\n") if len(array) else []
+
+
+def gather(offsets: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    """
+    Indices of all elements of the given rows of a CSR array, without a Python loop over the rows
+    """
+    starts = offsets[rows]
+    lengths = offsets[rows + 1] - starts
+    total = int(lengths.sum())
+    row_starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.arange(total) - row_starts + np.repeat(starts, lengths)
+
+
+class BM25Index:
+    """
+    BM25 over name, authors, category and description of every record. Term frequencies are summed over
+    the fields with FIELDS weights, so a shared author counts more than a shared description word.
+    Postings are flat numpy arrays per term (CSR) holding the final BM25 weight of every (term, record)
+    pair, and a query is one bincount over the postings of its terms. The terms of every record are kept
+    the same way, heaviest first, so a record can be the query itself with its MAX_QUERY_TERMS best terms
+    (as in "more like this" queries) instead of all of its words
+    """
+
+    FIELDS = {"name": 2.0, "authors": 3.0, "category": 1.0, "description_ru": 1.0}
+    MAX_QUERY_TERMS = 32
+    # saved indexes of another format are rebuilt
+    FORMAT = 2
+
+    def __init__(self, keys: List[str], terms: List[str], term_offsets, postings, weights, doc_offsets, doc_terms,
+                 metadata: MetadataIndex):
+        self.keys = keys
+        self.positions = {key: position for position, key in enumerate(keys)}
+        self.terms = {term: term_id for term_id, term in enumerate(terms)}
+        self.term_offsets = term_offsets
+        self.postings = postings
+        self.weights = weights
+        self.doc_offsets = doc_offsets
+        self.doc_terms = doc_terms
+        self.metadata = metadata
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.positions
+
+    @classmethod
+    def build(cls, items: Iterable[Tuple[str, dict]], k1=1.2, b=0.75) -> "BM25Index":
+        keys, doc_lengths, records = [], [], []
+        terms: Dict[str, int] = {}
+        term_ids, frequencies, doc_offsets = [], [], [0]
+        for key, record in items:
+            records.append({field: record.get(field) for field in (*MetadataIndex.FIELDS, "year")})
+            counts = Counter()
+            for field, weight in cls.FIELDS.items():
+                for token in tokenize(str(record.get(field) or "")):
+                    counts[token] += weight
+            keys.append(key)
+            doc_lengths.append(sum(counts.values()))
+            for token, frequency in counts.items():
+                term_ids.append(terms.setdefault(token, len(terms)))
+                frequencies.append(frequency)
+            doc_offsets.append(len(term_ids))
+
+        doc_terms = np.array(term_ids, dtype=np.int32)
+        frequencies = np.array(frequencies, dtype=np.float32)
+        doc_offsets = np.array(doc_offsets, dtype=np.int64)
+        doc_ids = np.repeat(np.arange(len(keys), dtype=np.int32), np.diff(doc_offsets))
+        doc_lengths = np.array(doc_lengths, dtype=np.float32)
+
+        # BM25 weight of every (term, record) pair, then the pairs are regrouped by term
+        document_frequency = np.bincount(doc_terms, minlength=len(terms))
+        idf = np.log1p((len(keys) - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+        norm = k1 * (1 - b + b * doc_lengths / max(float(doc_lengths.mean()) if len(keys) else 0.0, 1e-9))
+        weights = idf[doc_terms] * frequencies * (k1 + 1) / (frequencies + norm[doc_ids])
+        order = np.argsort(doc_terms, kind="stable")
+        term_offsets = np.concatenate([[0], np.cumsum(document_frequency)]).astype(np.int64)
+        by_weight = np.lexsort((-weights, doc_ids))
+        return cls(keys, list(terms), term_offsets, doc_ids[order], weights[order].astype(np.float32),
+                   doc_offsets, doc_terms[by_weight], MetadataIndex.from_records(records))
+
+    @classmethod
+    def from_corpus(cls, source: str, cache_dir: Optional[str] = ".cache/bm25") -> "BM25Index":
+        """
+        Loads the index of the corpus from the cache, building and saving it when the source has changed
+        """
+        path = None
+        source_hash = file_hash(source)
+        if cache_dir:
+            name = hashlib.sha256(os.path.abspath(source).encode("utf-8")).hexdigest()[:16]
+            path = os.path.join(cache_dir, name + ".npz")
+            if os.path.exists(path):
+                try:
+                    index, cached_hash = cls.load(path)
+                except ValueError:
+                    cached_hash = None
+                if cached_hash == source_hash:
+                    return index
+        data = open_corpus(source)
+        index = cls.build(data.items())
+        if path:
+            index.save(path, source_hash)
+        return index
+
+    def save(self, path: str, source_hash: str = ""):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            np.savez(
+                f,
+                keys=join_strings(self.keys),
+                terms=join_strings(self.terms),
+                term_offsets=self.term_offsets,
+                postings=self.postings,
+                weights=self.weights,
+                doc_offsets=self.doc_offsets,
+                doc_terms=self.doc_terms,
+                source_hash=join_strings([source_hash]),
+                format=np.array([self.FORMAT]),
+                **self.metadata.to_arrays(),
+            )
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path: str) -> Tuple["BM25Index", str]:
+        with np.load(path) as arrays:
+            if "format" not in arrays.files or int(arrays["format"][0]) != cls.FORMAT:
+                raise ValueError(f"{path} is not a BM25 index of format {cls.FORMAT}")
+            index = cls(
+                split_strings(arrays["keys"]),
+                split_strings(arrays["terms"]),
+                arrays["term_offsets"],
+                arrays["postings"],
+                arrays["weights"],
+                arrays["doc_offsets"],
+                arrays["doc_terms"],
+                MetadataIndex.from_arrays(arrays),
+            )
+            source_hash = split_strings(arrays["source_hash"])[0]
+        return index, source_hash
+
+    def query_terms(self, text: str) -> np.ndarray:
+        term_ids = {self.terms[token] for token in tokenize(text) if token in self.terms}
+        return np.fromiter(term_ids, dtype=np.int64, count=len(term_ids))
+
+    def record_terms(self, key: str, limit: Optional[int] = None) -> np.ndarray:
+        position = self.positions[key]
+        start, end = self.doc_offsets[position], self.doc_offsets[position + 1]
+        if limit is not None:
+            end = min(end, start + limit)
+        return self.doc_terms[start:end].astype(np.int64)
+
+    def top_k(self, term_ids: np.ndarray, k: int, exclude: Collection[str] = (),
+              where: Optional[Mapping] = None) -> List[Tuple[str, float]]:
+        """
+        (record key, score) of the k best records containing any of the terms and matching the metadata
+        filter (see MetadataIndex.mask), best first
+        """
+        selected = gather(self.term_offsets, term_ids)
+        scores = np.bincount(self.postings[selected], weights=self.weights[selected], minlength=len(self.keys))
+        mask = self.metadata.mask(where)
+        if mask is not None:
+            scores[~mask] = 0
+        for key in exclude:
+            if key in self.positions:
+                scores[self.positions[key]] = 0
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(self.keys[position], float(scores[position])) for position in candidates]
+
+    def search(self, text: str, k: int, exclude: Collection[str] = (),
+               where: Optional[Mapping] = None) -> List[Tuple[str, float]]:
+        return self.top_k(self.query_terms(text), k, exclude, where)
+
+    def search_record(self, key: str, k: int, exclude: Collection[str] = (),
+                      where: Optional[Mapping] = None) -> List[Tuple[str, float]]:
+        """
+        Records sharing the most weighted terms with the record `key`, which is itself excluded
+        """
+        return self.top_k(self.record_terms(key, self.MAX_QUERY_TERMS), k, {key, *exclude}, where)
+
+
+def reciprocal_rank_fusion(rankings: Iterable[List[str]], k=60) -> List[str]:
+    """
+    Keys of several rankings ordered by the sum of 1 / (k + rank) over the rankings they appear in
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, 1):
+            scores[key] = scores.get(key, 0.0) + 1 / (k + rank)
+    return sorted(scores, key=lambda key: -scores[key])
@@ -0,0 +1,86 @@
+import re
+from typing import Dict, Iterable, List, Mapping, Optional
+
+import numpy as np
+
+YEAR = re.compile(r"\d{4}")
+
+
+class MetadataIndex:
+    """
+    Bitmaps of the positions (records or chunks) having each value of the categorical FIELDS, and the year
+    of every position. A filter such as {"category": "Interactive Art", "year": (None, 1999)} becomes
+    one boolean mask of the allowed positions: values of a field are combined with |, fields with &.
+    A year range is inclusive, None leaves its side open, positions without a year never match it
+    """
+
+    FIELDS = ("category", "award")
+
+    def __init__(self, codes: Dict[str, np.ndarray], values: Dict[str, List[str]], years: np.ndarray):
+        self.codes = codes
+        self.values = values
+        self.years = years
+        self.bitmaps = {
+            field: {value: codes[field] == code for code, value in enumerate(values[field])}
+            for field in self.FIELDS
+        }
+
+    def __len__(self):
+        return len(self.years)
+
+    @classmethod
+    def from_records(cls, records: Iterable[Mapping]) -> "MetadataIndex":
+        values = {field: {} for field in cls.FIELDS}
+        codes = {field: [] for field in cls.FIELDS}
+        years = []
+        for record in records:
+            for field in cls.FIELDS:
+                value = str(record.get(field) or "")
+                codes[field].append(values[field].setdefault(value, len(values[field])))
+            year = YEAR.search(str(record.get("year") or ""))
+            years.append(int(year.group()) if year else -1)
+        return cls(
+            {field: np.array(codes[field], dtype=np.int32) for field in cls.FIELDS},
+            {field: list(values[field]) for field in cls.FIELDS},
+            np.array(years, dtype=np.int32),
+        )
+
+    def mask(self, where: Optional[Mapping]) -> Optional[np.ndarray]:
+        """
+        Boolean mask of the positions matching the filter, None when there is nothing to filter by
+        """
+        if not where:
+            return None
+        mask = np.ones(len(self), dtype=bool)
+        for field, value in where.items():
+            if field == "year":
+                first, last = value
+                mask &= self.years >= 0
+                if first is not None:
+                    mask &= self.years >= first
+                if last is not None:
+                    mask &= self.years <= last
+            elif field in self.FIELDS:
+                field_mask = np.zeros(len(self), dtype=bool)
+                for field_value in [value] if isinstance(value, str) else value:
+                    if field_value in self.bitmaps[field]:
+                        field_mask |= self.bitmaps[field][field_value]
+                mask &= field_mask
+            else:
+                raise ValueError(f"Unknown filter field: {field}")
+        return mask
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        arrays = {"years": self.years}
+        for field in self.FIELDS:
+            arrays[f"{field}_codes"] = self.codes[field]
+            arrays[f"{field}_values"] = np.frombuffer("\n".join(self.values[field]).encode("utf-8"), dtype=np.uint8)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays: Mapping[str, np.ndarray]) -> "MetadataIndex":
+        return cls(
+            {field: arrays[f"{field}_codes"] for field in cls.FIELDS},
+            {field: arrays[f"{field}_values"].tobytes().decode("utf-8").split("\n") for field in cls.FIELDS},
+            arrays["years"],
+        )
@@ -0,0 +1,69 @@
+import json
+import os
+from typing import Dict, List
+
+from core.corpus import file_hash
+
+
+class NeighbourTable:
+    """
+    Precomputed related artworks (record key -> keys of its nearest records), looked up without
+    loading the embedding model or the index. Built offline by build-neighbours.py from the source
+    whose content hash is stored with it; a table of another source is stale (see is_current)
+    """
+
+    def __init__(self, path: str):
+        with open(path, "r", encoding="utf-8") as f:
+            stored = json.load(f)
+        # tables written before the hash was stored have neither field and are never current
+        self.source_hash = stored.get("source_hash")
+        self.table = stored.get("neighbours", {})
+
+    def is_current(self, source: str) -> bool:
+        return self.source_hash == file_hash(source)
+
+    def __contains__(self, key):
+        return key in self.table
+
+    def get(self, key: str, k=2) -> List[str]:
+        return self.table.get(key, [])[:k]
+
+    @staticmethod
+    def save(path: str, table: Dict[str, List[str]], source: str):
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"source_hash": file_hash(source), "neighbours": table}, f, separators=(",", ":"))
+        os.replace(path + ".tmp", path)
+
+
+def build_neighbour_table(
+    vector_db, queries: Dict[str, str], k=5, fetch_k=16, lexical=None, candidates=20
+) -> Dict[str, List[str]]:
+    """
+    Finds k distinct nearest records for every query with one batched embedding pass
+    and one index.search over all of them (see VectorDB.search_records).
+    With a lexical index (core.lexical.BM25Index) the nearest records are fused with its
+    BM25 ranking by reciprocal rank, as in the hybrid Retriever mode
+    """
+    keys = list(queries)
+    vectors = vector_db.embeddings.embed_documents([queries[key] for key in keys])
+    records = vector_db.search_records(
+        vectors, max(k, candidates) if lexical else k, [{key} for key in keys], fetch_k
+    )
+    if lexical is None:
+        return {
+            key: [record_key for record_key, _, _ in key_records]
+            for key, key_records in zip(keys, records)
+        }
+
+    from core.lexical import reciprocal_rank_fusion
+
+    table = {}
+    for key, key_records in zip(keys, records):
+        if key in lexical:
+            lexical_records = lexical.search_record(key, max(k, candidates))
+        else:
+            lexical_records = lexical.search(queries[key], max(k, candidates), {key})
+        table[key] = reciprocal_rank_fusion(
+            [[record_key for record_key, _, _ in key_records], [record_key for record_key, _ in lexical_records]]
+        )[:k]
+    return table
@@ -0,0 +1,95 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from core.instrumentation import metrics
+
+# the model of a worker process, loaded once by load_model when the worker starts
+worker_model = None
+
+
+def load_model(model_path: str, threads: int):
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    global worker_model
+    torch.set_num_threads(threads)
+    worker_model = SentenceTransformer(model_path, device="cpu")
+
+
+def encode(texts: List[str]):
+    return worker_model.encode(texts, batch_size=len(texts), convert_to_numpy=True, normalize_embeddings=False)
+
+
+class ParallelEmbeddings(Embeddings):
+    """
+    Sentence-transformers embeddings computed on CPU by a pool of `workers` processes, each loading the model
+    once and running torch on its share of the cores. Texts are sorted by length and cut into batches of
+    batch_size, so a batch is padded to about the length of its own texts; the longest batches are handed out
+    first and every worker takes the next one when it is done, then the vectors are put back in the order of
+    the texts. Calls with at most batch_size texts (queries) run in this process.
+    The pool is started on the first large call and lives until close, so the batches of a streaming build
+    reuse the loaded models. Workers are spawned and import the main module, scripts using them need
+    an `if __name__ == "__main__"` guard
+    """
+
+    def __init__(self, model_path: str, workers: Optional[int] = None, batch_size=32,
+                 threads_per_worker: Optional[int] = None):
+        self.model_path = model_path
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // self.workers)
+        self.pool = None
+        self.model = None
+
+    def start(self) -> "ParallelEmbeddings":
+        if self.pool is None:
+            # spawned workers do not inherit the torch thread pools of this process
+            self.pool = ProcessPoolExecutor(
+                self.workers, mp_context=get_context("spawn"), initializer=load_model,
+                initargs=(self.model_path, self.threads_per_worker),
+            )
+        return self
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def __enter__(self) -> "ParallelEmbeddings":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        import numpy as np
+
+        # as HuggingFaceEmbeddings does
+        texts = [text.replace("\n", " ") for text in texts]
+        if len(texts) <= self.batch_size:
+            return self.local_model().encode(texts, convert_to_numpy=True, normalize_embeddings=False).tolist()
+        order = sorted(range(len(texts)), key=lambda i: -len(texts[i]))
+        batches = [order[start:start + self.batch_size] for start in range(0, len(order), self.batch_size)]
+        self.start()
+        vectors = None
+        with metrics.span("embed_parallel", texts=len(texts), batches=len(batches), workers=self.workers):
+            results = self.pool.map(encode, [[texts[i] for i in batch] for batch in batches])
+            for batch, batch_vectors in zip(batches, results):
+                if vectors is None:
+                    vectors = np.empty((len(texts), batch_vectors.shape[1]), dtype=np.float32)
+                vectors[batch] = batch_vectors
+        return vectors.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def local_model(self):
+        if self.model is None:
+            from sentence_transformers import SentenceTransformer
+
+            self.model = SentenceTransformer(self.model_path, device="cpu")
+        return self.model
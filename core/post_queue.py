@@ -0,0 +1,93 @@
+import asyncio
+import json
+import os
+from typing import Callable, Iterable, List, Optional
+
+from core.artwork_analysis import Artwork
+from core.instrumentation import metrics
+
+
+class PostQueue:
+    """
+    Pre-generated posts, one JSON object per line. Posts are added as soon as they are ready; every change
+    rewrites the file through a temporary file and a rename, so a crash while writing leaves the queue
+    as it was instead of a partial line that fails every later read
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def read(self) -> List[dict]:
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def keys(self) -> set:
+        return {post["key"] for post in self.read()}
+
+    def peek(self) -> Optional[dict]:
+        posts = self.read()
+        return posts[0] if posts else None
+
+    def extend(self, posts: Iterable[dict]):
+        self.write(self.read() + list(posts))
+
+    def put(self, post: dict):
+        """
+        Puts the post first, in place of the queued post with the same key, so the next run takes it
+        """
+        self.write([post] + [queued for queued in self.read() if queued["key"] != post["key"]])
+
+    def remove(self, key: str):
+        self.write([post for post in self.read() if post["key"] != key])
+
+    def write(self, posts: List[dict]):
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            for post in posts:
+                f.write(json.dumps(post, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.path + ".tmp", self.path)
+
+
+async def generate_posts(
+    keys: Iterable[str],
+    data: dict,
+    artwork_retriever,
+    analyser,
+    prepare_post: Callable[[str, dict, Optional[str]], dict],
+    queue: Optional[PostQueue] = None,
+    with_review: Callable[[dict], bool] = lambda artwork: True,
+) -> List[dict]:
+    """
+    Generates posts for keys concurrently with an AsyncArtworkAnalyser, which bounds the number
+    of requests in flight. Every finished post is appended to the queue right away; keys whose
+    generation failed are reported and skipped
+    """
+
+    async def generate(key):
+        with metrics.post(key), metrics.span("generate"):
+            artwork = data[key]
+            review = None
+            if with_review(artwork):
+                main_artwork = Artwork(artwork, key)
+                with metrics.span("retrieve"):
+                    related_artworks = artwork_retriever.get_related_artworks(main_artwork)
+                with metrics.span("review"):
+                    review = await analyser.analyze_artworks(main_artwork, related_artworks)
+            with metrics.span("format"):
+                post = prepare_post(key, artwork, review)
+            if queue:
+                queue.extend([post])
+            return post
+
+    keys = list(keys)
+    results = await asyncio.gather(*(generate(key) for key in keys), return_exceptions=True)
+    posts = []
+    for key, result in zip(keys, results):
+        if isinstance(result, Exception):
+            print(f'Post for {key} was not generated: {result!r}')
+        else:
+            posts.append(result)
+    return posts
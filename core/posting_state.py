@@ -0,0 +1,171 @@
+import fcntl
+import json
+import os
+import random
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Iterable, List, Optional
+
+
+class PostingState:
+    """
+    Keys waiting to be posted, claimed by a running post, and already posted, per channel, in SQLite.
+    Waiting keys are stored as a dense array (pos 0..size-1), so a random key is taken by swapping the last
+    element into its place and deleting the last one, without reading or rewriting the backlog.
+    Every change is a single transaction, so a crash leaves either the old or the new state
+    """
+
+    def __init__(self, path: str = "posting_state.sqlite", channel: str = ""):
+        self.path = path
+        self.channel = channel
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS waiting (
+                channel TEXT NOT NULL, pos INTEGER NOT NULL, key TEXT NOT NULL,
+                PRIMARY KEY (channel, pos), UNIQUE (channel, key)
+            );
+            CREATE TABLE IF NOT EXISTS claimed (
+                channel TEXT NOT NULL, key TEXT NOT NULL, claimed_at REAL NOT NULL,
+                PRIMARY KEY (channel, key)
+            );
+            CREATE TABLE IF NOT EXISTS posted (
+                channel TEXT NOT NULL, key TEXT NOT NULL, posted_at REAL NOT NULL, message_ids TEXT NOT NULL,
+                PRIMARY KEY (channel, key)
+            );
+            CREATE TABLE IF NOT EXISTS channels (
+                channel TEXT PRIMARY KEY, size INTEGER NOT NULL, source_mtime REAL
+            );
+            """
+        )
+
+    @contextmanager
+    def transaction(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    @contextmanager
+    def lock(self):
+        """
+        Exclusive lock of the channel for the whole run, raises RuntimeError if another runner holds it
+        """
+        lock_path = f"{self.path}.{self.channel.strip('@') or 'default'}.lock"
+        with open(lock_path, "w") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise RuntimeError(f"Another runner is posting to {self.channel or 'the channel'}")
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def size(self, connection=None) -> int:
+        row = (connection or self.connection).execute(
+            "SELECT size FROM channels WHERE channel = ?", (self.channel,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def sync(self, keys_path: str):
+        """
+        Adds keys of a comma-separated file (not_posted.txt) that are neither waiting, claimed nor posted.
+        The file is read again only when its modification time changes
+        """
+        mtime = os.path.getmtime(keys_path)
+        row = self.connection.execute(
+            "SELECT source_mtime FROM channels WHERE channel = ?", (self.channel,)
+        ).fetchone()
+        if row and row[0] == mtime:
+            return
+        with open(keys_path, "r") as f:
+            keys = [key.strip() for key in f.readline().split(",") if key.strip()]
+        with self.transaction() as connection:
+            known = set()
+            for table in ("waiting", "claimed", "posted"):
+                known.update(
+                    key for (key,) in connection.execute(f"SELECT key FROM {table} WHERE channel = ?", (self.channel,))
+                )
+            self.push(connection, [key for key in dict.fromkeys(keys) if key not in known])
+            connection.execute(
+                "UPDATE channels SET source_mtime = ? WHERE channel = ?", (mtime, self.channel)
+            )
+
+    def push(self, connection, new_keys: List[str]):
+        """
+        Appends keys to the end of the array, the caller makes sure none of them is already known
+        """
+        size = self.size(connection)
+        connection.executemany(
+            "INSERT INTO waiting (channel, pos, key) VALUES (?, ?, ?)",
+            ((self.channel, size + i, key) for i, key in enumerate(new_keys)),
+        )
+        connection.execute(
+            "INSERT INTO channels (channel, size) VALUES (?, ?) "
+            "ON CONFLICT (channel) DO UPDATE SET size = excluded.size",
+            (self.channel, size + len(new_keys)),
+        )
+
+    def claim_random(self) -> Optional[str]:
+        """
+        Moves a random waiting key to the claimed ones and returns it, None if nothing is waiting
+        """
+        with self.transaction() as connection:
+            size = self.size(connection)
+            if size == 0:
+                return None
+            pos = random.randrange(size)
+            (key,) = connection.execute(
+                "SELECT key FROM waiting WHERE channel = ? AND pos = ?", (self.channel, pos)
+            ).fetchone()
+            connection.execute("DELETE FROM waiting WHERE channel = ? AND pos = ?", (self.channel, pos))
+            if pos != size - 1:
+                connection.execute(
+                    "UPDATE waiting SET pos = ? WHERE channel = ? AND pos = ?", (pos, self.channel, size - 1)
+                )
+            connection.execute("UPDATE channels SET size = ? WHERE channel = ?", (size - 1, self.channel))
+            connection.execute(
+                "INSERT INTO claimed (channel, key, claimed_at) VALUES (?, ?, ?)", (self.channel, key, time.time())
+            )
+        return key
+
+    def claimed(self) -> List[str]:
+        return [
+            key for (key,) in self.connection.execute("SELECT key FROM claimed WHERE channel = ?", (self.channel,))
+        ]
+
+    def mark_posted(self, key: str, message_ids: Iterable[int] = ()):
+        with self.transaction() as connection:
+            connection.execute("DELETE FROM claimed WHERE channel = ? AND key = ?", (self.channel, key))
+            connection.execute(
+                "INSERT OR REPLACE INTO posted (channel, key, posted_at, message_ids) VALUES (?, ?, ?, ?)",
+                (self.channel, key, time.time(), json.dumps(list(message_ids))),
+            )
+
+    def release(self, keys: Iterable[str]):
+        """
+        Returns claimed keys to the waiting ones, e.g. after a failed post or a crashed run
+        """
+        with self.transaction() as connection:
+            released = [
+                key for key in dict.fromkeys(keys)
+                if connection.execute(
+                    "DELETE FROM claimed WHERE channel = ? AND key = ?", (self.channel, key)
+                ).rowcount
+            ]
+            self.push(connection, released)
+
+    def posted(self) -> List[dict]:
+        rows = self.connection.execute(
+            "SELECT key, posted_at, message_ids FROM posted WHERE channel = ? ORDER BY posted_at", (self.channel,)
+        )
+        return [
+            {"key": key, "posted_at": posted_at, "message_ids": json.loads(message_ids)}
+            for key, posted_at, message_ids in rows
+        ]
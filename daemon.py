@@ -0,0 +1,250 @@
+"""
+Long-running poster: the corpus, the retriever (vector DB or neighbour table), the OpenAI client, the image
+pipeline and the Telegram bot are loaded once, and every channel posts on its own cron schedule.
+The next post of a channel is generated `--lead` minutes before its slot, so at the slot only sending is left.
+Health and timing stats are served as JSON on http://127.0.0.1:8080/health, with --metrics-prometheus the stage
+timings and counters of core.instrumentation are also written for the Prometheus textfile collector after every slot
+
+    python daemon.py --schedule "0 12 * * 1,4"
+    python daemon.py --channels channels.json
+
+channels.json is a list of {"channel_id": ..., "schedule": ..., "keys": "not_posted.txt", "queue": ..., "mirrors": [...]}
+"""
+import argparse
+import asyncio
+import json
+import signal
+import time
+from contextlib import ExitStack
+from datetime import datetime, timedelta
+from typing import List, Mapping
+
+from core.artwork_analysis import AsyncArtworkAnalyser
+from core.corpus import default_source, open_corpus
+from core.delivery import Delivery
+from core.image_pipeline import ImagePipeline
+from core.instrumentation import metrics
+from core.post_queue import PostQueue, generate_posts
+from core.posting_state import PostingState
+from core.response_cache import ResponseCache
+from core.scheduler import CronSchedule
+from main import OPENAI_API_KEY, TELEGRAM_API_KEY, channel_id, deliver, get_artwork_retriever, prepare_post, with_review
+
+
+async def sleep_until(moment: datetime):
+    await asyncio.sleep(max(0.0, (moment - datetime.now()).total_seconds()))
+
+
+class Channel:
+    """
+    Schedule, posting state and queue of one channel, with its timing stats.
+    Mirrors get the same posts at the same time
+    """
+
+    def __init__(self, channel: str, schedule: str, keys_path: str = 'not_posted.txt',
+                 queue_path: str = 'post_queue.jsonl', state_path: str = 'posting_state.sqlite',
+                 mirrors: List[str] = ()):
+        self.channel = channel
+        self.mirrors = list(mirrors)
+        self.schedule = CronSchedule(schedule)
+        self.keys_path = keys_path
+        self.state = PostingState(state_path, channel)
+        self.queue = PostQueue(queue_path)
+        self.stats = {
+            'schedule': schedule,
+            'next_slot': None,
+            'posts': 0,
+            'failures': 0,
+            'last_error': None,
+            'last_key': None,
+            'last_post_at': None,
+            'last_generate_s': None,
+            'last_send_s': None,
+            'last_post_latency_s': None,
+        }
+
+    def recover(self):
+        self.state.sync(self.keys_path)
+        # claims that are not queued were left by a run that crashed before posting
+        queued = self.queue.keys()
+        self.state.release(key for key in self.state.claimed() if key not in queued)
+
+    def health(self) -> dict:
+        return dict(self.stats, channel=self.channel, queued=len(self.queue.read()), waiting=self.state.size())
+
+
+class Daemon:
+    def __init__(self, source: str, channels: List[Channel], lead: timedelta, concurrency: int = 4):
+        self.source = source
+        self.channels = channels
+        self.lead = lead
+        self.concurrency = concurrency
+        self.started_at = time.time()
+        self.load_s = {}
+        self.data: Mapping[str, dict] = None
+        self.artwork_retriever = None
+        self.analyser = None
+        self.image_pipeline = None
+        self.delivery = None
+
+    def timed_load(self, name: str, function):
+        start = time.perf_counter()
+        with metrics.span(f'{name}_load'):
+            result = function()
+        self.load_s[name] = round(time.perf_counter() - start, 3)
+        return result
+
+    def load(self):
+        self.data = self.timed_load('corpus', lambda: open_corpus(self.source))
+        self.artwork_retriever = self.timed_load('retriever', lambda: get_artwork_retriever(self.source))
+        self.image_pipeline = self.timed_load('image_pipeline', ImagePipeline)
+        self.analyser = self.timed_load('analyser', lambda: AsyncArtworkAnalyser(
+            OPENAI_API_KEY, concurrency=self.concurrency, cache=ResponseCache(), images=self.image_pipeline
+        ))
+
+    async def prepare(self, channel: Channel):
+        """
+        Makes sure the channel has a queued post with its photos fetched
+        """
+        if channel.queue.peek() is not None:
+            return
+        channel.state.sync(channel.keys_path)
+        key = channel.state.claim_random()
+        if key is None:
+            raise RuntimeError(f'Nothing left to post to {channel.channel}')
+        start = time.perf_counter()
+        try:
+            posts = await generate_posts([key], self.data, self.artwork_retriever, self.analyser, prepare_post,
+                                         channel.queue, with_review)
+        finally:
+            channel.state.release({key} - channel.queue.keys())
+        if not posts:
+            raise RuntimeError(f'Post for {key} was not generated')
+        await asyncio.to_thread(self.image_pipeline.fetch, posts[0]['images'])
+        channel.stats['last_generate_s'] = round(time.perf_counter() - start, 3)
+
+    async def post(self, channel: Channel, slot: datetime):
+        await self.prepare(channel)
+        post = channel.queue.peek()
+        key = post['key']
+        start = time.perf_counter()
+        channel.stats['last_post_latency_s'] = round((datetime.now() - slot).total_seconds(), 3)
+        # channel -> step -> message ids of the steps delivered before, by this daemon or a run of main.py
+        sent = post.get('sent', {})
+        try:
+            message_ids = await deliver(self.delivery, post, [channel.channel, *channel.mirrors], sent)
+        except BaseException:
+            if any(sent.values()):
+                # the post is queued with its progress (timed-out steps included), a restart or the next slot
+                # only sends the steps that are left
+                channel.queue.put(dict(post, sent=sent))
+            raise
+        channel.stats['last_send_s'] = round(time.perf_counter() - start, 3)
+        channel.state.mark_posted(key, message_ids)
+        channel.queue.remove(key)
+        channel.stats.update(posts=channel.stats['posts'] + 1, last_key=key, last_post_at=time.time())
+
+    async def run_channel(self, channel: Channel):
+        while True:
+            slot = channel.schedule.next_after(datetime.now())
+            channel.stats['next_slot'] = slot.isoformat()
+            await sleep_until(slot - self.lead)
+            # a failed generation is retried at the slot, a failed post stays queued for the next slot
+            for step in (lambda: self.prepare(channel), lambda: sleep_until(slot), lambda: self.post(channel, slot)):
+                try:
+                    await step()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    channel.stats['failures'] += 1
+                    channel.stats['last_error'] = f'{datetime.now().isoformat()}: {e!r}'
+                    print(f'{channel.channel}: {e!r}')
+            metrics.flush()
+
+    def health(self) -> dict:
+        return {
+            'uptime_s': round(time.time() - self.started_at),
+            'load_s': self.load_s,
+            'openai_retries': self.analyser.retries if self.analyser else None,
+            'response_cache': self.analyser.cache.stats() if self.analyser else None,
+            'image_bytes_fetched': self.image_pipeline.bytes_fetched if self.image_pipeline else None,
+            'delivery': self.delivery.stats() if self.delivery else None,
+            'metrics': metrics.summary() if metrics.enabled else None,
+            'channels': [channel.health() for channel in self.channels],
+        }
+
+    async def handle_health(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await reader.readline()
+            while (await reader.readline()).strip():
+                pass
+            path = request.split()[1].decode() if len(request.split()) > 1 else ''
+            if path == '/health':
+                status, body = '200 OK', json.dumps(self.health(), ensure_ascii=False)
+            else:
+                status, body = '404 Not Found', '{}'
+            body = body.encode()
+            writer.write(f'HTTP/1.1 {status}\r\nContent-Type: application/json\r\n'
+                         f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def run(self, host: str, port: int):
+        server = await asyncio.start_server(self.handle_health, host, port)
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signal_number, stop.set)
+        start = time.perf_counter()
+        async with server, Delivery(TELEGRAM_API_KEY, self.image_pipeline) as self.delivery:
+            self.load_s['delivery'] = round(time.perf_counter() - start, 3)
+            tasks = [asyncio.create_task(self.run_channel(channel)) for channel in self.channels]
+            print(f'Serving {len(tasks)} channels, health on http://{host}:{port}/health, loaded in {self.load_s}')
+            await stop.wait()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def read_channels(args) -> List[Channel]:
+    if args.channels:
+        with open(args.channels, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    else:
+        config = [{'channel_id': channel_id, 'schedule': args.schedule}]
+    channels = []
+    for item in config:
+        # the default channel keeps the queue of main.py
+        default_queue = 'post_queue.jsonl' if item['channel_id'] == channel_id else \
+            f'post_queue.{item["channel_id"].strip("@")}.jsonl'
+        channels.append(Channel(item['channel_id'], item['schedule'], item.get('keys', 'not_posted.txt'),
+                                item.get('queue', default_queue), mirrors=item.get('mirrors', [])))
+    return channels
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--schedule', default='0 12 * * *', help='cron schedule of the default channel')
+    parser.add_argument('--channels', default=None, help='JSON list of channels with their schedules')
+    parser.add_argument('--lead', type=float, default=15, help='minutes to generate a post ahead of its slot')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--metrics-jsonl', default=None, metavar='PATH',
+                        help='append stage timings, token usage and retries as JSON lines')
+    parser.add_argument('--metrics-prometheus', default=None, metavar='PATH',
+                        help='write their totals as a Prometheus text file after every post')
+    args = parser.parse_args()
+    metrics.configure(args.metrics_jsonl, args.metrics_prometheus)
+
+    source = default_source()
+    channels = read_channels(args)
+    daemon = Daemon(source, channels, timedelta(minutes=args.lead), args.concurrency)
+    with ExitStack() as stack:
+        # the channels stay locked while the daemon runs, so a cron run of main.py can not post twice
+        for channel in channels:
+            stack.enter_context(channel.state.lock())
+            channel.recover()
+        daemon.load()
+        asyncio.run(daemon.run(args.host, args.port))
@@ -11,6 +11,7 @@ OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 client = OpenAI(api_key=OPENAI_API_KEY)
 
 from core.artwork_analysis import Artwork, ArtworkRetriever, ArtworkAnalyser
+from core.response_cache import ResponseCache
 
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 source = 'ars_electronica_prizewinners_ru.json'
@@ -24,12 +25,12 @@ key = random.choice(not_posted)
 
 main_artwork_data = data[key]
 
-main_artwork = Artwork(main_artwork_data)
+main_artwork = Artwork(main_artwork_data, key)
 
 artwork_retriever = ArtworkRetriever(source)
 related_artworks = artwork_retriever.get_related_artworks(main_artwork)
 
-analysis = ArtworkAnalyser(OPENAI_API_KEY)
+analysis = ArtworkAnalyser(OPENAI_API_KEY, cache=ResponseCache())
 analysis_result = analysis.analyze_artworks(main_artwork, related_artworks)
 
 print(analysis_result)
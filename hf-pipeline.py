@@ -4,6 +4,7 @@ import torch
 import gc
 from dotenv import load_dotenv
 from core.artwork_analysis import Artwork, ArtworkRetriever, HFArtworkAnalyser
+from core.response_cache import ResponseCache
 
 load_dotenv()
 
@@ -16,7 +17,7 @@ with open(path, 'r') as f:
 
 key = random.choice(not_posted)
 main_artwork_data = data[key]
-main_artwork = Artwork(main_artwork_data)
+main_artwork = Artwork(main_artwork_data, key)
 
 artwork_retriever = ArtworkRetriever(source)
 related_artworks = artwork_retriever.get_related_artworks(main_artwork)
@@ -29,7 +30,7 @@ r = torch.cuda.memory_reserved(0)
 a = torch.cuda.memory_allocated(0)
 f = r-a
 print(f)  # free inside reserved
-hf_analysis = HFArtworkAnalyser()
+hf_analysis = HFArtworkAnalyser(cache=ResponseCache())
 hf_analysis_result = hf_analysis.analyze_artworks(main_artwork, related_artworks)
 
 print(hf_analysis_result)
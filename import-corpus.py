@@ -0,0 +1,13 @@
+import argparse
+import time
+
+from core.corpus import CorpusStore
+
+parser = argparse.ArgumentParser(description='Imports the corpus JSON into an indexed SQLite store')
+parser.add_argument('--source', default='ars_electronica_prizewinners_ru.json')
+parser.add_argument('--output', default='ars_electronica_prizewinners_ru.sqlite')
+args = parser.parse_args()
+
+start = time.perf_counter()
+store = CorpusStore.import_json(args.source, args.output)
+print(f'{len(store)} records imported into {args.output} in {time.perf_counter() - start:.2f}s')
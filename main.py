@@ -1,119 +1,161 @@
+import argparse
 import asyncio
-import json
 import os
-import random
+from typing import Mapping, Sequence
 
-import telegram
 from dotenv import load_dotenv
 
-from core.artwork_analysis import Artwork, ArtworkRetriever, ArtworkAnalyser
+from core import formatter
+from core.artwork_analysis import Artwork, ArtworkRetriever, ArtworkAnalyser, AsyncArtworkAnalyser
+from core.corpus import default_source, open_corpus
+from core.delivery import Delivery
+from core.image_pipeline import ImagePipeline
+from core.instrumentation import metrics
+from core.post_queue import PostQueue, generate_posts
+from core.posting_state import PostingState
+from core.response_cache import ResponseCache
 
 load_dotenv()
 
 TELEGRAM_API_KEY = os.getenv('TG_TOKEN')
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 channel_id = '@science_art_at_least_once_a_week'
-MAX_POST_LENGTH = 4096
-MAX_CAPTION_LENGTH = 1024
 
 
-def get_message_text(artwork: dict, message_length: int = 0, to_cut=False):
-    if to_cut:
-        return f'*{artwork["name"]}*\n\n{artwork["authors"]}\n\n_{artwork["award"]}, {artwork["year"]}_\n' \
-               f'_{artwork["category"]}_\n\n{cut(artwork["description_ru"], message_length)}\n\n{artwork["url"]}\n\n' \
-               f'{to_hashtag(artwork["award"])} {to_hashtag(artwork["category"])} {to_hashtag(artwork["year"]) + "year"}'
-    return f'*{artwork["name"]}*\n\n{artwork["authors"]}\n\n_{artwork["award"]}, {artwork["year"]}_\n' \
-           f'_{artwork["category"]}_\n\n{artwork["description_ru"]}\n\n{artwork["url"]}\n\n' \
-           f'{to_hashtag(artwork["award"])} {to_hashtag(artwork["category"])} {to_hashtag(artwork["year"]) + "year"}'
-
-
-def get_caption_text(artwork: dict):
-    return f'*{artwork["name"]}*\n\n_{artwork["authors"]} ({artwork["year"]})_\n\n{artwork["url"]}\n\n' \
-           f'{to_hashtag(artwork["award"])} {to_hashtag(artwork["category"])} {to_hashtag(artwork["year"]) + "year"}'
+def prepare_post(key: str, artwork: dict, review: str = None) -> dict:
+    """
+    The description is cut to fit the message. Not more than 5 photos are posted: with the message
+    as caption if it is short, otherwise in the next message with their own caption
+    """
+    return {
+        'key': key,
+        'message': formatter.message_text(artwork),
+        'caption': formatter.caption_text(artwork),
+        'images': artwork['img_list'][:5],
+        'review': formatter.review_text(review) if review else None,
+    }
 
 
-def cut(text: str, length: int):
-    cut_length = MAX_POST_LENGTH - length
-    return text[:cut_length - 3] + '...'
+def with_review(artwork: dict) -> bool:
+    return artwork['category'] != 'Visionary Pioneers of Media Art'
 
 
-def to_hashtag(text: str) -> str:
-    return '#' + text.lower().replace('-', '').replace('–', '')\
-        .replace('(', '').replace(')', '').replace('/', ' ').replace('&', '')\
-        .replace('   ', ' ').replace('  ', ' ').replace(' ', '\_')
+async def deliver(delivery: Delivery, post: dict, chat_ids: Sequence[str], sent: dict = None) -> list:
+    """
+    Sends the post to the channels concurrently and returns the ids of the messages in the first one.
+    Failed mirrors (the other channels) are reported without failing the post
+    """
+    with metrics.post(post['key']), metrics.span('deliver', channels=len(chat_ids)):
+        results = await delivery.fan_out(post, chat_ids, sent=sent)
+    for chat_id, result in results.items():
+        if isinstance(result, Exception) and chat_id != chat_ids[0]:
+            print(f'Mirror {chat_id}: {result!r}')
+    if isinstance(results[chat_ids[0]], Exception):
+        raise results[chat_ids[0]]
+    return results[chat_ids[0]]
 
 
-def remove_markdown(text: str) -> str:
-    # removes all markdown symbols from text
-    return text.replace('*', '').replace('_', '')
+async def main(post: dict, image_pipeline: ImagePipeline = None, mirrors: Sequence[str] = (),
+               sent: dict = None) -> list:
+    async with Delivery(TELEGRAM_API_KEY, image_pipeline) as delivery:
+        message_ids = await deliver(delivery, post, [channel_id, *mirrors], sent)
+        print(f'Sent {message_ids}, {delivery.stats()}')
+        return message_ids
 
 
-def update_posted(path: str, key: str):
-    keys = list(open(path, 'r').readline().split(','))
-    new_keys = [old_key for old_key in keys if old_key != key]
-    new_text = ','.join([new_key for new_key in new_keys])
-    with open(path, 'w') as f:
-        f.write(new_text)
-        f.close()
+def get_artwork_retriever(source: str) -> ArtworkRetriever:
+    neighbours = 'neighbours.json'
+    return ArtworkRetriever(source, neighbours if os.path.exists(neighbours) else None, mode='hybrid')
 
 
-async def run_bot():
+async def generate(source: str, data: Mapping[str, dict], state: PostingState, queue: PostQueue, count: int,
+                   concurrency: int, image_pipeline: ImagePipeline):
     """
-    If the description is too long, it will be cut. Not more than 5 photos will be posted in the next message.
-    If the description is too long for caption, <= 5 photos will be posted in the next message.
-    If the description is short, it will be posted with one photo as caption.
+    Keys of the generated posts stay claimed until they are posted, the others are released
     """
-    bot = telegram.Bot(TELEGRAM_API_KEY)
-    async with bot:
-        message = get_message_text(main_artwork_data)
-        if len(message) >= MAX_POST_LENGTH:
-            len_wo_desc = len(message) - len(main_artwork_data['description_ru'])
-            message = get_message_text(main_artwork_data, len_wo_desc, to_cut=True)
-            print(await bot.send_message(chat_id=channel_id, text=message, parse_mode='markdown', read_timeout=60))
-            images = [telegram.InputMediaPhoto(photo) for photo in main_artwork_data['img_list'][:5]]
-            if len(images) > 0:
-                caption = get_caption_text(main_artwork_data)
-                print(await bot.send_media_group(chat_id=channel_id, media=images, caption=caption,
-                                                 parse_mode='markdown', read_timeout=60))
-        elif MAX_CAPTION_LENGTH <= len(message) < MAX_POST_LENGTH:
-            print(await bot.send_message(chat_id=channel_id, text=message, parse_mode='markdown', read_timeout=60))
-            images = [telegram.InputMediaPhoto(photo) for photo in main_artwork_data['img_list'][:5]]
-            if len(images) > 0:
-                caption = get_caption_text(main_artwork_data)
-                print(await bot.send_media_group(chat_id=channel_id, media=images, caption=caption,
-                                                 parse_mode='markdown', read_timeout=60))
-        elif len(message) < MAX_CAPTION_LENGTH:
-            if len(main_artwork_data['img_list']) > 0:
-                print(await bot.send_photo(chat_id=channel_id, photo=main_artwork_data['img_list'][0],
-                                           caption=message, parse_mode='markdown', read_timeout=60))
-            else:
-                print(await bot.send_message(chat_id=channel_id, text=message, parse_mode='markdown', read_timeout=60))
-        if main_artwork_data['category'] != 'Visionary Pioneers of Media Art':
-            print(await bot.send_message(chat_id=channel_id, text=review_ru, parse_mode='markdown', read_timeout=60))
-
-
-async def main():
+    keys = [key for key in (state.claim_random() for _ in range(count)) if key]
+    with metrics.span('retriever_load'):
+        artwork_retriever = get_artwork_retriever(source)
+    analyser = AsyncArtworkAnalyser(OPENAI_API_KEY, concurrency=concurrency, cache=ResponseCache(),
+                                    images=image_pipeline)
     try:
-        await run_bot()
-    except Exception:
-        data[key]['description_ru'] = remove_markdown(data[key]['description_ru'])
-        await run_bot()
+        posts = await generate_posts(keys, data, artwork_retriever, analyser, prepare_post, queue, with_review)
+    finally:
+        state.release(set(keys) - queue.keys())
+    # photos of the queued posts are fetched now, so posting does not depend on the archive host
+    await asyncio.to_thread(image_pipeline.fetch, [image for post in posts for image in post['images']])
+    print(f'{len(posts)} posts queued, {analyser.retries} retries, cache: {analyser.cache.stats()}')
 
 
 if __name__ == '__main__':
-    source = 'ars_electronica_prizewinners_ru.json'
-    data = json.load(open(source, 'r', encoding='utf-8'))
-    path = 'not_posted.txt'
-    not_posted = open(path, 'r').readline().split(',')
-    key = random.choice(not_posted)
-    print(f'Key is {key}')
-    main_artwork_data = data[key]
-    main_artwork = Artwork(main_artwork_data)
-    artwork_retriever = ArtworkRetriever(source)
-    related_artworks = artwork_retriever.get_related_artworks(main_artwork)
-
-    analysis = ArtworkAnalyser(OPENAI_API_KEY)
-    analysis_result = analysis.analyze_artworks(main_artwork, related_artworks)
-    review_ru = analysis_result + '\n\n_Рецензия GPT-4_'
-    asyncio.run(main())
-    update_posted(path, key)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--generate', type=int, default=0, metavar='N',
+                        help='pre-generate N posts into the queue instead of posting')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--mirror', action='append', default=[], metavar='CHANNEL',
+                        help='also send the post to this channel, can be repeated')
+    parser.add_argument('--metrics-jsonl', default=None, metavar='PATH',
+                        help='append stage timings, token usage and retries as JSON lines')
+    parser.add_argument('--metrics-prometheus', default=None, metavar='PATH',
+                        help='write their totals as a Prometheus text file on exit')
+    args = parser.parse_args()
+    metrics.configure(args.metrics_jsonl, args.metrics_prometheus)
+
+    source = default_source()
+    with metrics.span('corpus_load'):
+        data = open_corpus(source)
+    # not_posted.txt seeds the posting state, keys added to it later are picked up on the next run
+    state = PostingState('posting_state.sqlite', channel_id)
+    queue = PostQueue('post_queue.jsonl')
+    image_pipeline = ImagePipeline()
+
+    with state.lock():
+        state.sync('not_posted.txt')
+        # claims that are not queued were left by a run that crashed before posting
+        queued = queue.keys()
+        state.release(key for key in state.claimed() if key not in queued)
+
+        if args.generate:
+            asyncio.run(generate(source, data, state, queue, args.generate, args.concurrency, image_pipeline))
+        else:
+            post = queue.peek()
+            queued_post = post is not None
+            # channel -> step -> message ids of the steps delivered by an earlier run that failed
+            sent = post.get('sent', {}) if queued_post else {}
+            if queued_post:
+                key = post['key']
+                print(f'Key is {key} (queued)')
+            else:
+                key = state.claim_random()
+                if key is None:
+                    raise SystemExit('Nothing left to post')
+                print(f'Key is {key}')
+            try:
+                if not queued_post:
+                    with metrics.post(key), metrics.span('generate'):
+                        main_artwork_data = data[key]
+                        review_ru = None
+                        if with_review(main_artwork_data):
+                            main_artwork = Artwork(main_artwork_data, key)
+                            with metrics.span('retriever_load'):
+                                artwork_retriever = get_artwork_retriever(source)
+                            with metrics.span('retrieve'):
+                                related_artworks = artwork_retriever.get_related_artworks(main_artwork)
+
+                            analysis = ArtworkAnalyser(OPENAI_API_KEY, cache=ResponseCache(), images=image_pipeline)
+                            with metrics.span('review'):
+                                review_ru = analysis.analyze_artworks(main_artwork, related_artworks)
+                        with metrics.span('format'):
+                            post = prepare_post(key, main_artwork_data, review_ru)
+                message_ids = asyncio.run(main(post, image_pipeline, args.mirror, sent))
+            except BaseException:
+                if any(sent.values()):
+                    # the post is queued with its progress, the next run only sends the steps that are left;
+                    # a step that timed out is in it too, so a post Telegram may have published stays claimed
+                    queue.put(dict(post, sent=sent))
+                elif not queued_post:
+                    state.release([key])
+                # a queued post stays claimed and is retried by the next run
+                raise
+            state.mark_posted(key, message_ids)
+            queue.remove(key)
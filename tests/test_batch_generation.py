@@ -0,0 +1,129 @@
+"""
+Batch post generation with AsyncArtworkAnalyser against the local chat-completions stand-in (FakeOpenAI)
+"""
+import asyncio
+import functools
+import json
+
+import openai
+import pytest
+
+import main
+from benchmarks.batch_generation import FakeRetriever, fake_corpus
+from benchmarks.fake_servers import FakeOpenAI
+from core.artwork_analysis import Artwork, AsyncArtworkAnalyser
+from core.post_queue import PostQueue, generate_posts
+from core.posting_state import PostingState
+from core.response_cache import ResponseCache
+
+
+class FailingRetriever(FakeRetriever):
+    def __init__(self, data, failing):
+        super().__init__(data)
+        self.failing = failing
+
+    def get_related_artworks(self, main_artwork, k=2):
+        if main_artwork.key in self.failing:
+            raise RuntimeError(f"no related artworks for {main_artwork.key}")
+        return super().get_related_artworks(main_artwork, k)
+
+
+class ImagesByURL:
+    """
+    Image pipeline that leaves the URLs to the API and fetches nothing
+    """
+
+    def get_many(self, images, target, as_data_url=False):
+        return images
+
+    def fetch(self, images):
+        pass
+
+
+def generate(data, analyser, queue=None, retriever=None):
+    return asyncio.run(generate_posts(
+        list(data), data, retriever or FakeRetriever(data), analyser, main.prepare_post, queue, main.with_review
+    ))
+
+
+def test_rate_limits_and_server_errors_are_retried():
+    data = fake_corpus(12)
+    with FakeOpenAI(latency=0, rate_limit_every=3, server_error_every=5) as server:
+        analyser = AsyncArtworkAnalyser("test", concurrency=4, base_url=server.base_url)
+        posts = generate(data, analyser)
+        requests = len(server.requests)
+
+    assert sorted(post["key"] for post in posts) == sorted(data)
+    failed = [number for number in range(1, requests + 1) if number % 3 == 0 or number % 5 == 0]
+    assert any(number % 3 == 0 for number in failed) and any(number % 5 == 0 for number in failed)
+    assert analyser.retries == len(failed) == requests - len(data)
+
+
+def test_exhausted_retries_raise():
+    data = fake_corpus(3)
+    with FakeOpenAI(latency=0, rate_limit_every=1) as server:
+        analyser = AsyncArtworkAnalyser("test", max_retries=2, base_url=server.base_url)
+        artwork = Artwork(data["0"], "0")
+        with pytest.raises(openai.RateLimitError):
+            asyncio.run(analyser.analyze_artworks(artwork, FakeRetriever(data).get_related_artworks(artwork)))
+        assert len(server.requests) == 3
+
+
+def test_every_post_is_queued(tmp_path):
+    data = fake_corpus(8)
+    queue = PostQueue(str(tmp_path / "post_queue.jsonl"))
+    with FakeOpenAI(latency=0) as server:
+        posts = generate(data, AsyncArtworkAnalyser("test", concurrency=3, base_url=server.base_url), queue)
+
+    assert len(posts) == len(data)
+    assert sorted(post["key"] for post in queue.read()) == sorted(data)
+    assert all(post["review"].startswith("Review #") for post in queue.read())
+
+
+def test_failed_keys_are_skipped_and_released(tmp_path, monkeypatch):
+    data = fake_corpus(6)
+    keys_path = tmp_path / "not_posted.txt"
+    keys_path.write_text(",".join(data))
+    state = PostingState(str(tmp_path / "posting_state.sqlite"), "@channel")
+    state.sync(str(keys_path))
+    queue = PostQueue(str(tmp_path / "post_queue.jsonl"))
+    # 4 of the 6 keys are claimed, so at least one of them fails and one does not
+    failing = {"1", "3", "5"}
+    claimed = []
+    claim_random = state.claim_random
+
+    def claim_and_record():
+        claimed.append(claim_random())
+        return claimed[-1]
+
+    with FakeOpenAI(latency=0) as server:
+        monkeypatch.setattr(main, "OPENAI_API_KEY", "test")
+        monkeypatch.setattr(main, "AsyncArtworkAnalyser",
+                            functools.partial(AsyncArtworkAnalyser, base_url=server.base_url))
+        monkeypatch.setattr(main, "ResponseCache", lambda: ResponseCache(str(tmp_path / "responses.sqlite")))
+        monkeypatch.setattr(main, "get_artwork_retriever", lambda source: FailingRetriever(data, failing))
+        monkeypatch.setattr(state, "claim_random", claim_and_record)
+        asyncio.run(main.generate("corpus.json", data, state, queue, 4, 2, ImagesByURL()))
+
+    generated = set(claimed) - failing
+    assert len(claimed) == 4 and generated and generated != set(claimed)
+    assert queue.keys() == generated
+    # the failed keys are waiting again, the queued ones stay claimed until they are posted
+    assert set(state.claimed()) == generated
+    assert state.size() == len(data) - len(generated)
+
+
+def test_interrupted_write_leaves_the_queue_intact(tmp_path, monkeypatch):
+    queue = PostQueue(str(tmp_path / "post_queue.jsonl"))
+    queue.extend([{"key": "0"}, {"key": "1"}])
+    json_dumps = json.dumps
+
+    def dumps(post, **kwargs):
+        if post["key"] == "3":
+            raise KeyboardInterrupt
+        return json_dumps(post, **kwargs)
+
+    monkeypatch.setattr("core.post_queue.json.dumps", dumps)
+    with pytest.raises(KeyboardInterrupt):
+        queue.extend([{"key": "2"}, {"key": "3"}])
+    assert [post["key"] for post in queue.read()] == ["0", "1"]
@@ -0,0 +1,79 @@
+"""
+Delivery against the local Bot API stand-in (FakeTelegram)
+"""
+import asyncio
+import time
+
+import pytest
+from telegram.error import BadRequest, TimedOut
+
+import main
+from benchmarks.delivery import TOKEN, fake_post
+from benchmarks.fake_servers import FakeTelegram
+from core.delivery import Delivery, DeliveryError
+
+# the message, the media group of its 3 photos and the review
+METHODS = ["sendMessage", "sendMediaGroup", "sendMediaGroup", "sendMediaGroup", "sendMessage"]
+
+
+async def deliver(fake, post, chat_id, sent=None, **kwargs):
+    async with Delivery(TOKEN, base_url=fake.base_url, **kwargs) as delivery:
+        return await delivery.deliver(post, chat_id, sent), delivery
+
+
+def test_flood_wait_is_honoured_and_retried():
+    with FakeTelegram(latency=0, flood_every=3, retry_after=1) as fake:
+        start = time.perf_counter()
+        message_ids, delivery = asyncio.run(deliver(fake, fake_post(0), "@channel"))
+        elapsed = time.perf_counter() - start
+
+    assert delivery.flood_waits == 1 and delivery.retries == 0
+    assert elapsed >= 1
+    assert [method for _, method, _ in fake.messages] == METHODS
+    assert len(message_ids) == len(METHODS)
+
+
+def test_timed_out_step_is_not_retried():
+    sent = {}
+    with FakeTelegram(latency=1) as fake:
+        with pytest.raises(DeliveryError) as error:
+            asyncio.run(deliver(fake, fake_post(0), "@channel", sent, timeout=0.2))
+        # the one request may still be delivered by the server, it is not sent again
+        assert next(fake.counter) == 2
+
+    assert isinstance(error.value.cause, TimedOut)
+    assert error.value.step == "message"
+    assert sent == {"message": None}
+
+
+def test_resume_sends_only_the_missing_steps():
+    post = fake_post(0)
+    with FakeTelegram(latency=0, server_error_every=2) as fake:
+        with pytest.raises(DeliveryError) as error:
+            asyncio.run(deliver(fake, post, "@channel", max_retries=0))
+        assert error.value.step == "media"
+        assert error.value.sent == {"message": [1]}
+
+        fake.server_error_every = 0
+        message_ids, _ = asyncio.run(deliver(fake, post, "@channel", error.value.sent))
+
+    assert [method for _, method, _ in fake.messages] == METHODS
+    assert message_ids == [1, 2, 3, 4, 5]
+
+
+def test_failed_mirror_does_not_fail_the_channel():
+    post = fake_post(0)
+
+    async def fan_out(fake):
+        async with Delivery(TOKEN, base_url=fake.base_url) as delivery:
+            return await delivery.fan_out(post, ["@channel", "@mirror"]), \
+                await main.deliver(delivery, post, ["@channel", "@mirror"])
+
+    with FakeTelegram(latency=0, failing_chats={"@mirror"}) as fake:
+        results, message_ids = asyncio.run(fan_out(fake))
+
+    assert len(results["@channel"]) == len(METHODS)
+    assert isinstance(results["@mirror"], DeliveryError)
+    assert isinstance(results["@mirror"].cause, BadRequest) and results["@mirror"].sent == {}
+    assert len(message_ids) == len(METHODS)
+    assert [chat_id for chat_id, _, _ in fake.messages] == ["@channel"] * 2 * len(METHODS)
@@ -0,0 +1,87 @@
+"""
+An index built from an older corpus and updated incrementally to the fixture corpus answers like an index
+built from the fixture corpus at once. Hashing embeddings keep the test deterministic and model-free
+"""
+import json
+
+import pytest
+
+from benchmarks.suite import FIXTURE, HashingEmbeddings
+from core.document_retrieval import VectorDB
+
+
+class CountingEmbeddings(HashingEmbeddings):
+    def __init__(self):
+        super().__init__()
+        self.texts = 0
+
+    def embed_documents(self, texts):
+        self.texts += len(texts)
+        return super().embed_documents(texts)
+
+
+def build(source, cache_dir=None):
+    vector_db = VectorDB(source, cache_dir=cache_dir)
+    vector_db.embeddings = CountingEmbeddings()
+    vector_db.create_db()
+    return vector_db
+
+
+def results(vector_db, data, where=None, k=5):
+    """
+    Scores of the top k records of every record's description and the records above the k-th score with
+    their best chunk. Hashing embeddings give whole distances, records tied with the k-th one may be
+    returned in either index
+    """
+    keys = list(data)
+    vectors = HashingEmbeddings().embed_documents([data[key]["description_ru"] for key in keys])
+    records = vector_db.search_records(vectors, k, [{key} for key in keys], where=where)
+    return [
+        (
+            [pytest.approx(score, abs=1e-4) for _, score, _ in query_records],
+            sorted(
+                (key, vector_db.document(position).page_content)
+                for key, score, position in query_records if score > query_records[-1][1] + 1e-4
+            ),
+        )
+        for query_records in records
+    ]
+
+
+@pytest.fixture
+def corpus():
+    with open(FIXTURE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_update_matches_rebuild(tmp_path, corpus):
+    keys = list(corpus)
+    old = {key: dict(corpus[key]) for key in keys[:-10]}
+    for key in keys[5:25:4]:
+        old[key]["description_ru"] = old[key]["description_ru"][::-1]
+    # only in the old corpus, its chunks have to be deleted from the index
+    old["deleted"] = dict(corpus[keys[0]], name="Deleted")
+
+    source = str(tmp_path / "corpus.json")
+    cache_dir = str(tmp_path / "cache")
+    with open(source, "w", encoding="utf-8") as f:
+        json.dump(old, f, ensure_ascii=False)
+    build(source, cache_dir)
+    with open(source, "w", encoding="utf-8") as f:
+        json.dump(corpus, f, ensure_ascii=False)
+
+    incremental = build(source, cache_dir)
+    full = build(FIXTURE)
+
+    # only the 10 appended and 5 changed records were embedded
+    assert 0 < incremental.embeddings.texts < full.embeddings.texts
+    assert incremental.db.index.ntotal == full.db.index.ntotal
+    assert incremental.records == full.records
+    assert results(incremental, corpus) == results(full, corpus)
+    where = {"category": "Hybrid Art"}
+    assert results(incremental, corpus, where) == results(full, corpus, where)
+
+    # the updated cache is reused as is
+    reloaded = build(source, cache_dir)
+    assert reloaded.embeddings.texts == 0
+    assert results(reloaded, corpus) == results(full, corpus)